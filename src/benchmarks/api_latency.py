@@ -0,0 +1,124 @@
+"""
+Load test of the weather API through the ASGI application, at a fixed concurrency.
+
+Requests are sent straight to the ASGI callable, without a server or the test
+client in between, for random seeded cities, and the p50 / p99 latency and
+throughput are reported:
+
+    cd src && python -m benchmarks.api_latency --cities 1000 --concurrency 50 --seconds 10 --output api.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from urllib.parse import urlencode
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weather_wise.settings')
+os.environ.setdefault('DJANGO_ALLOW_ASYNC_UNSAFE', 'true')  # only to seed rows from the main thread
+
+import django  # noqa: E402
+
+django.setup()
+
+from collections import Counter  # noqa: E402
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from benchmarks.harness import (  # noqa: E402
+    add_report_arguments, peak_rss_mb, percentile, report, run_async, test_databases,
+)
+from weatherapp.models import City, WeatherData  # noqa: E402
+
+
+def seed(cities: int) -> list[str]:
+    names = [f'city{i}' for i in range(cities)]
+    stored = City.objects.bulk_create(
+        [City(name=name, country='XX', latitude=0, longitude=0, active=True) for name in names], batch_size=5000
+    )
+    WeatherData.objects.bulk_insert([
+        WeatherData(
+            city=city, temperature=20, min_temperature=18, max_temperature=22,
+            humidity=50, pressure=1000, wind_speed=1, wind_degree=90,
+        )
+        for city in stored
+    ])
+    return names
+
+
+async def get(application, path: str, query: dict) -> int:
+    """Send one GET request to the ASGI ``application`` and return the status code."""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': urlencode(query).encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # the client never disconnects; the handler cancels this wait once it responded
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def run(names: list[str], concurrency: int, seconds: float, warmup: float) -> dict:
+    application = get_asgi_application()
+    path = reverse('weather-api')
+    latencies = []
+    statuses = Counter()
+
+    async def worker(deadline: float, record: bool):
+        while time.monotonic() < deadline:
+            started_at = time.perf_counter()
+            status = await get(application, path, {'city': random.choice(names)})
+            if record:
+                latencies.append(time.perf_counter() - started_at)
+                statuses[status] += 1
+
+    if warmup:
+        await asyncio.gather(*(worker(time.monotonic() + warmup, False) for _ in range(concurrency)))
+    started_at = time.monotonic()
+    await asyncio.gather(*(worker(started_at + seconds, True) for _ in range(concurrency)))
+    elapsed = time.monotonic() - started_at
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'non_200': sum(count for status, count in statuses.items() if status != 200),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of untimed requests, to fill the caches')
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    with test_databases():
+        names = seed(args.cities)
+        results = run_async(run(names, args.concurrency, args.seconds, args.warmup))
+    report('api_latency', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Local stand-in for the OpenWeather API, so benchmarks and tests need no network.
+
+It answers the weather, group and box endpoints with synthetic reports, after
+an optional latency, and injects errors and 429 responses at the given rates:
+
+    async with FakeOpenWeather(latency=0.05, throttle_rate=0.01) as server:
+        client = OpenWeatherAPIClient(api_key='fake', base_url=server.base_url)
+"""
+import asyncio
+import random
+import socket
+from collections import Counter
+from typing import Any, Optional
+from aiohttp import web
+
+
+class FakeOpenWeather:
+    """
+    aiohttp server answering like the OpenWeather API for any city.
+    attributes:
+        latency (float): Seconds every response is delayed.
+        jitter (float): Upper bound of a random delay added to ``latency``.
+        error_rate (float): Share of the requests answered with ``error_status``.
+        error_first (int): The number of requests answered with ``error_status`` first, as during an outage.
+        error_status (int): The status code of the injected errors, 500 by default or e.g. 401.
+        throttle_rate (float): Share of the requests answered with 429.
+        retry_after (Optional[float]): The ``Retry-After`` of a 429 in seconds, left out when None.
+        payload_size (int): Bytes of padding added to every report, to mimic heavier payloads.
+        statuses (Counter): Number of responses sent per status code.
+
+    The report of a city is derived from its OpenWeather ID, and a coordinate
+    lookup answers with an ID derived from the coordinates, so every run of a
+    benchmark fetches the same data.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            error_rate: float = 0.0,
+            error_first: int = 0,
+            error_status: int = 500,
+            throttle_rate: float = 0.0,
+            retry_after: Optional[float] = 1.0,
+            payload_size: int = 0,
+            seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_first = error_first
+        self.error_status = error_status
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.payload_size = payload_size
+        self.statuses = Counter()
+        self._requests = 0
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self._port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._port}/data'
+
+    async def __aenter__(self) -> 'FakeOpenWeather':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        """Listen on a free local port."""
+        app = web.Application()
+        app.router.add_get('/data/{version}/weather', self.weather)
+        app.router.add_get('/data/{version}/group', self.group)
+        app.router.add_get('/data/{version}/box/city', self.box)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self._port = sock.getsockname()[1]
+        await web.SockSite(self._runner, sock).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+        self._runner = None
+
+    def report(self, city_id: int, latitude: float, longitude: float) -> dict[str, Any]:
+        """The report of a city, shaped like an item of a group response."""
+        temperature = 280 + city_id % 25 + (city_id % 100) / 100
+        report = {
+            'coord': {'lon': longitude, 'lat': latitude},
+            'sys': {'country': 'XX', 'timezone': 0, 'sunrise': 1729220400, 'sunset': 1729260000},
+            'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky', 'icon': '01d'}],
+            'main': {
+                'temp': temperature, 'feels_like': temperature - 1, 'temp_min': temperature - 2,
+                'temp_max': temperature + 2, 'pressure': 1000 + city_id % 30, 'humidity': city_id % 100,
+            },
+            'visibility': 10000,
+            'wind': {'speed': (city_id % 150) / 10, 'deg': city_id % 360},
+            'clouds': {'all': city_id % 100},
+            'dt': 1729240000,
+            'id': city_id,
+            'name': f'city{city_id}',
+        }
+        if self.payload_size:
+            report['padding'] = 'x' * self.payload_size
+        return report
+
+    async def _respond(self, body: dict[str, Any]) -> web.Response:
+        self._requests += 1
+        request_number = self._requests
+        if delay := self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0):
+            await asyncio.sleep(delay)
+        draw = self._random.random()
+        if request_number <= self.error_first or draw < self.error_rate:
+            body = {'cod': self.error_status, 'message': 'Injected error'}
+            response = web.json_response(body, status=self.error_status)
+        elif draw < self.error_rate + self.throttle_rate:
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else None
+            response = web.json_response({'cod': 429, 'message': 'Too many requests'}, status=429, headers=headers)
+        else:
+            response = web.json_response(body)
+        self.statuses[response.status] += 1
+        return response
+
+    async def weather(self, request: web.Request) -> web.Response:
+        latitude, longitude = float(request.query['lat']), float(request.query['lon'])
+        # above the IDs of the group endpoint, and still within a PositiveIntegerField
+        city_id = 10 ** 9 + int((latitude + 90) * 100) * 36001 + int((longitude + 180) * 100)
+        return await self._respond(self.report(city_id, latitude, longitude))
+
+    async def group(self, request: web.Request) -> web.Response:
+        items = [
+            self.report(city_id, city_id % 180 - 90, city_id % 360 - 180)
+            for city_id in map(int, request.query['id'].split(','))
+        ]
+        return await self._respond({'cnt': len(items), 'list': items})
+
+    async def box(self, request: web.Request) -> web.Response:
+        lon_left, lat_bottom, lon_right, lat_top = map(float, request.query['bbox'].split(',')[:4])
+        items = [
+            self.report(int((latitude + 90) * 360 + longitude + 180), latitude, longitude)
+            for latitude in range(int(lat_bottom), int(lat_top))
+            for longitude in range(int(lon_left), int(lon_right))
+        ]
+        return await self._respond({'cod': 200, 'calctime': 0.01, 'cnt': len(items), 'list': items})
@@ -0,0 +1,98 @@
+"""
+Helpers shared by the benchmarks: a throwaway test database, and results written
+as JSON so runs of two commits can be compared with ``--baseline``.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import subprocess
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Coroutine, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def test_databases() -> Iterator[None]:
+    """Run the block against freshly created test databases, dropped afterwards."""
+    setup_test_environment()
+    # a database left behind by an interrupted run is dropped instead of prompted for
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+def run_async(main: Coroutine) -> Any:
+    """Run ``main`` in a new event loop, then close the connections opened by its ``sync_to_async`` calls.
+
+    They belong to the executor thread, and left open they keep the test database from being dropped.
+    """
+    async def run_and_close():
+        try:
+            return await main
+        finally:
+            await sync_to_async(connections.close_all)()
+
+    return asyncio.run(run_and_close())
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """The ``q``-th percentile (0-100) of already sorted values, by the nearest rank."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip()
+
+
+def add_report_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results file of a previous run')
+
+
+def report(benchmark: str, args: argparse.Namespace, results: dict[str, Any]) -> None:
+    """Print the results, compare them with the ``--baseline`` file and write them to ``--output``."""
+    previous = json.loads(Path(args.baseline).read_text())['results'] if args.baseline else {}
+    for name, value in results.items():
+        line = f'{name:<30} {value:>12.3f}' if isinstance(value, float) else f'{name:<30} {value!s:>12}'
+        if type(value) in (int, float) and type(previous.get(name)) in (int, float) and previous[name]:
+            line += f'  ({(value - previous[name]) / previous[name]:+.1%} vs baseline)'
+        print(line)
+
+    if args.output:
+        document = {
+            'benchmark': benchmark,
+            'commit': git_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': {name: value for name, value in vars(args).items() if name not in ('output', 'baseline')},
+            'results': results,
+        }
+        Path(args.output).write_text(json.dumps(document, indent=2) + '\n')
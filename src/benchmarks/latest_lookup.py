@@ -0,0 +1,85 @@
+"""
+Benchmark of the latest-observation lookup used by the weather API.
+
+Compares the former ``sync_to_async(get_latest)`` path with the native async
+``aget_latest`` at a fixed concurrency, on a throwaway test database:
+
+    cd src && python -m benchmarks.latest_lookup --cities 200 --concurrency 50 --seconds 5 --output lookup.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from typing import Awaitable, Callable
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weather_wise.settings')
+os.environ.setdefault('DJANGO_ALLOW_ASYNC_UNSAFE', 'true')  # only to seed rows from the main thread
+
+import django  # noqa: E402
+
+django.setup()
+
+from asgiref.sync import sync_to_async  # noqa: E402
+from benchmarks.harness import add_report_arguments, report, run_async, test_databases  # noqa: E402
+from weatherapp.models import City, LatestWeather, WeatherData  # noqa: E402
+
+
+def seed(cities: int, rows: int) -> list[str]:
+    names = [f'city{i}' for i in range(cities)]
+    stored = City.objects.bulk_create([City(name=name, country='XX', latitude=0, longitude=0) for name in names])
+    WeatherData.objects.bulk_insert([
+        WeatherData(
+            city=city, temperature=20, min_temperature=18, max_temperature=22,
+            humidity=50, pressure=1000, wind_speed=1, wind_degree=90,
+        )
+        for city in stored
+        for _ in range(rows)
+    ])
+    return names
+
+
+async def measure(lookup: Callable[[str], Awaitable], names: list[str], concurrency: int, seconds: float) -> float:
+    """Run ``lookup`` from ``concurrency`` tasks for ``seconds`` and return the requests per second."""
+    done = 0
+    deadline = time.monotonic() + seconds
+
+    async def worker():
+        nonlocal done
+        while time.monotonic() < deadline:
+            await lookup(random.choice(names))
+            done += 1
+
+    started_at = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done / (time.monotonic() - started_at)
+
+
+async def run(names: list[str], concurrency: int, seconds: float) -> dict[str, float]:
+    def sync_to_async_lookup(city):
+        # the lookup as it was before: every column, wrapped in sync_to_async
+        return sync_to_async(lambda: WeatherData.objects.filter(city__name=city).latest('timestamp'))()
+
+    return {
+        'sync_to_async_get_latest_rps': await measure(sync_to_async_lookup, names, concurrency, seconds),
+        'aget_latest_rps': await measure(LatestWeather.objects.aget_latest, names, concurrency, seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=20, help='observations per city')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=5)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    with test_databases():
+        names = seed(args.cities, args.rows)
+        results = run_async(run(names, args.concurrency, args.seconds))
+    report('latest_lookup', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark of a full ``WeatherLoader.run()`` against a local OpenWeather stand-in.
+
+Seeds synthetic cities on a throwaway test database, serves them from
+``FakeOpenWeather`` with the given latency and injected errors, and reports
+the cities written per second and the peak RSS of the process:
+
+    cd src && python -m benchmarks.loader_throughput --cities 5000 --latency 0.05 --output loader.json
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weather_wise.settings')
+os.environ.setdefault('DJANGO_ALLOW_ASYNC_UNSAFE', 'true')  # only to seed rows from the main thread
+
+import django  # noqa: E402
+
+django.setup()
+
+from benchmarks.fake_openweather import FakeOpenWeather  # noqa: E402
+from benchmarks.harness import add_report_arguments, peak_rss_mb, report, run_async, test_databases  # noqa: E402
+from loader.weather_loader import WeatherLoader  # noqa: E402
+from openweather.client import OpenWeatherAPIClient  # noqa: E402
+from weatherapp.models import City  # noqa: E402
+
+
+def seed(cities: int, unknown_ids: float) -> None:
+    """Create ``cities`` active cities, the share ``unknown_ids`` of them without an OpenWeather ID."""
+    without_id = int(cities * unknown_ids)
+    City.objects.bulk_create([
+        City(
+            name=f'city{i}', country='XX', latitude=i % 180 - 90, longitude=i % 360 - 180, active=True,
+            openweather_id=None if i < without_id else i,
+        )
+        for i in range(cities)
+    ], batch_size=5000)
+
+
+async def run(args: argparse.Namespace, server: FakeOpenWeather) -> dict:
+    client = OpenWeatherAPIClient(api_key='fake', base_url=server.base_url, connection_limit=args.workers)
+    async with client:
+        loader = WeatherLoader(client=client, calls_per_minute=args.calls_per_minute, max_workers=args.workers)
+        started_at = time.monotonic()
+        await loader.run()
+        elapsed = time.monotonic() - started_at
+
+    written = loader.cities_written
+    return {
+        'cities_written': written,
+        'seconds': elapsed,
+        'cities_per_second': written / elapsed,
+        'requests': sum(server.statuses.values()),
+        'throttled': server.statuses[429],
+        'errors': server.statuses[args.error_status],
+        'cities_failed': loader.cities_failed,
+        'circuit_breaker_state': loader.circuit_breaker.state,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+async def serve_and_run(args: argparse.Namespace) -> dict:
+    server = FakeOpenWeather(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_first=args.error_first,
+        error_status=args.error_status, throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after, payload_size=args.payload_size, seed=0,
+    )
+    async with server:
+        return await run(args, server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=2000)
+    parser.add_argument('--unknown-ids', type=float, default=0.0, help='share of cities fetched by coordinates')
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--calls-per-minute', type=int, default=60000)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per upstream response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of error responses')
+    parser.add_argument('--error-first', type=int, default=0, help='number of error responses to start with')
+    parser.add_argument('--error-status', type=int, default=500, help='status code of the error responses')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of 429 responses')
+    parser.add_argument('--retry-after', type=float, default=0.1)
+    parser.add_argument('--payload-size', type=int, default=0, help='bytes of padding per report')
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    with test_databases():
+        seed(args.cities, args.unknown_ids)
+        results = run_async(serve_and_run(args))
+    report('loader_throughput', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Benchmark of parsing OpenWeather group responses, as done by the weather loader.
+
+Decodes and parses the recorded group payload of 20 cities with the standard
+library decoder and, when it is installed, with orjson, both per report and
+into a columnar batch:
+
+    cd src && python -m benchmarks.parse_reports --number 2000
+"""
+import argparse
+import json
+import timeit
+from pathlib import Path
+
+from openweather.client import orjson
+from openweather.items import WeatherReport, WeatherReportBatch
+
+PAYLOAD = Path(__file__).resolve().parent.parent / 'weatherapp' / 'testdata' / 'openweather_group.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='payloads parsed per measurement')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payload = PAYLOAD.read_bytes()
+    decoders = {'json': json.loads} | ({'orjson': orjson.loads} if orjson is not None else {})
+    for decoder_name, loads in decoders.items():
+        cases = {
+            'per report': lambda: [WeatherReport.from_json_response(item) for item in loads(payload)['list']],
+            'batch': lambda: WeatherReportBatch.from_json_list(loads(payload)['list']),
+        }
+        for case_name, parse in cases.items():
+            best = min(timeit.repeat(parse, number=args.number, repeat=args.repeat)) / args.number
+            print(f'{decoder_name:<7} {case_name:<11} {best * 1e6:>8.1f} us/payload')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+from weatherapp import metrics
+
+
+@dataclass(frozen=True)
+class FailurePolicy:
+    """
+    How one class of errors opens the circuit breaker.
+    attributes:
+        name (str): The name of the policy, e.g. 'network'.
+        failure_rate (float): The share of failed requests within ``window`` that opens the breaker.
+        min_requests (int): The number of requests within ``window`` before the failure rate is considered.
+        max_failures (Optional[int]): When set, the number of failures within ``window`` that opens the breaker
+            instead of the failure rate, however many requests succeeded meanwhile.
+        window (float): Seconds of outcomes the failure rate is computed over.
+        cool_down (float): Seconds the breaker stays open before a probe request is let through.
+        max_cool_down (float): The cool-down doubles every time a probe fails, up to this many seconds.
+    """
+    name: str
+    failure_rate: float = 0.5
+    min_requests: int = 5
+    max_failures: Optional[int] = None
+    window: float = 30.0
+    cool_down: float = 5.0
+    max_cool_down: float = 60.0
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker in front of the upstream, with a failure policy per class of errors.
+    attributes:
+        policies (dict[type[Exception], FailurePolicy]): The policy of every error class counted as a failure.
+        state (str): 'closed', 'open' or 'half-open'.
+        opened_by (Optional[FailurePolicy]): The policy whose failures opened the breaker.
+        retry_at (float): The monotonic time from which a probe is let through while open.
+
+    While closed, every request goes through and its outcome is recorded in the
+    window of each policy. Once the failure rate or count of a policy is reached, the
+    breaker opens and rejects requests for that policy's cool-down. Then a single
+    probe is let through (half-open) and other requests wait for its outcome: a
+    success closes the breaker, a failure opens it again for twice as long.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half-open', 'open'
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, policies: dict[type[Exception], FailurePolicy]) -> None:
+        self.policies = policies
+        self.state = self.CLOSED
+        self.opened_by: Optional[FailurePolicy] = None
+        self.retry_at = 0.0
+        self._cool_down = 0.0
+        # per policy, the (time, failed) outcomes within its window and how many of them failed
+        self._outcomes: dict[str, deque[tuple[float, bool]]] = {policy.name: deque() for policy in policies.values()}
+        self._failures: dict[str, int] = {policy.name: 0 for policy in policies.values()}
+        self._probe_done: Optional[asyncio.Event] = None
+
+    def policy_for(self, exc: Exception) -> Optional[FailurePolicy]:
+        for error_class, policy in self.policies.items():
+            if isinstance(exc, error_class):
+                return policy
+        return None
+
+    def retry_in(self) -> float:
+        """Seconds until a request is let through again, 0 unless open."""
+        return max(0.0, self.retry_at - time.monotonic()) if self.state == self.OPEN else 0.0
+
+    async def allow(self) -> bool:
+        """Whether a request may be sent now.
+
+        Once the cool-down is over, the first caller is let through as the probe
+        and the callers after it wait for the probe's outcome.
+        """
+        while self.state == self.HALF_OPEN:
+            await self._probe_done.wait()
+        if self.state == self.CLOSED:
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
+        self._probe_done = asyncio.Event()
+        self._set_state(self.HALF_OPEN)
+        return True
+
+    def record_success(self) -> None:
+        """Record a request the upstream answered, even with an error that is not a failure of any policy."""
+        self._record(None)
+        if self.state == self.HALF_OPEN:
+            self._close()
+
+    def record_failure(self, exc: Exception) -> None:
+        """Record a failed request, and open the breaker if its policy says so."""
+        if (policy := self.policy_for(exc)) is None:
+            self.record_success()
+            return
+        self._record(policy)
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._tripped(policy)):
+            self._open(policy)
+
+    def _record(self, failed_policy: Optional[FailurePolicy]) -> None:
+        now = time.monotonic()
+        for policy in self.policies.values():
+            outcomes = self._outcomes[policy.name]
+            outcomes.append((now, policy is failed_policy))
+            self._failures[policy.name] += policy is failed_policy
+            while outcomes and outcomes[0][0] < now - policy.window:
+                self._failures[policy.name] -= outcomes.popleft()[1]
+
+    def record_throttled(self, retry_after: Optional[float] = None) -> None:
+        """Record a throttled request, which tells nothing about the health of the upstream.
+
+        A throttled probe neither closes nor reopens the breaker: another probe is
+        let through once ``retry_after`` seconds passed.
+        """
+        if self.state == self.HALF_OPEN:
+            self.retry_at = time.monotonic() + (retry_after or 0.0)
+            self._set_state(self.OPEN)
+
+    def _tripped(self, policy: FailurePolicy) -> bool:
+        if policy.max_failures is not None:
+            return self._failures[policy.name] >= policy.max_failures
+        requests = len(self._outcomes[policy.name])
+        return requests >= policy.min_requests and self._failures[policy.name] / requests >= policy.failure_rate
+
+    def _open(self, policy: FailurePolicy) -> None:
+        previous = self._cool_down if self.state == self.HALF_OPEN else 0.0
+        self._cool_down = min(max(policy.cool_down, previous * 2), policy.max_cool_down)
+        self.retry_at = time.monotonic() + self._cool_down
+        self.opened_by = policy
+        metrics.CIRCUIT_BREAKER_TRIPS.labels(policy=policy.name).inc()
+        self._set_state(self.OPEN)
+
+    def _close(self) -> None:
+        self._cool_down = 0.0
+        self.opened_by = None
+        for name, outcomes in self._outcomes.items():
+            outcomes.clear()
+            self._failures[name] = 0
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        metrics.CIRCUIT_BREAKER_STATE.set(self.STATE_VALUES[state])
+        if state != self.HALF_OPEN and self._probe_done is not None:
+            self._probe_done.set()
@@ -1,6 +1,11 @@
-import io
+import csv
+import gzip
+import json
+import tempfile
 import aiohttp
-from typing import AsyncIterable
+from pathlib import Path
+from typing import AsyncIterable, Iterator, Optional
+from urllib.parse import urlparse
 from collections import namedtuple
 from openpyxl import load_workbook
 
@@ -9,28 +14,134 @@ CityData = namedtuple("CityData", ['name', 'lon', 'lat', 'country'])
 
 class CityLoader:
     """
-    Asynchronous loader for city data from an Excel file.
+    Asynchronous loader for city data from an Excel, CSV or JSON file.
     attributes:
-        url (str): The URL of the Excel file to download.
+        url (str): The URL of the file to download. CSV and JSON files may be gzipped.
         override (bool): Whether to override the existing data in the database.
+        download_dir (Path): The directory the downloaded file and its validators are kept in.
+        force (bool): Whether to parse the file even if it has not changed since the last download.
+
+    The file is streamed to ``download_dir`` in chunks. An interrupted download
+    is resumed with an HTTP Range request, and a file that did not change
+    upstream (by ETag / Last-Modified) is not downloaded or parsed again.
     """
 
-    def __init__(self, url: str, override: bool = False):
+    chunk_size = 64 * 1024
+
+    def __init__(self, url: str, override: bool = False, download_dir: Optional[str] = None, force: bool = False):
         self.url = url
         self.override = override
+        self.force = force
+        self.download_dir = Path(download_dir or tempfile.gettempdir()) / 'city_loader'
+        self.file_name = Path(urlparse(url).path).name or 'cities'
+
+    @property
+    def file_path(self) -> Path:
+        return self.download_dir / self.file_name
+
+    @property
+    def partial_path(self) -> Path:
+        return self.download_dir / f'{self.file_name}.part'
+
+    @property
+    def validators_path(self) -> Path:
+        return self.download_dir / f'{self.file_name}.validators.json'
+
+    def _read_validators(self) -> dict[str, str]:
+        try:
+            return json.loads(self.validators_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    async def download_file(self) -> Optional[Path]:
+        """Download the file unless it is unchanged upstream.
+
+        Returns the path of the downloaded file, or ``None`` when the file was
+        already downloaded and has not changed since.
+        """
+
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        validators = self._read_validators()
+        headers = {}
+        if self.file_path.exists():
+            if etag := validators.get('etag'):
+                headers['If-None-Match'] = etag
+            if last_modified := validators.get('last_modified'):
+                headers['If-Modified-Since'] = last_modified
+        elif (offset := self.partial_path.stat().st_size if self.partial_path.exists() else 0) > 0:
+            headers['Range'] = f'bytes={offset}-'
+            if if_range := validators.get('etag') or validators.get('last_modified'):
+                headers['If-Range'] = if_range
 
-    async def download_excel_file(self) -> io.BytesIO:
         async with aiohttp.ClientSession(raise_for_status=True) as http_client:
-            async with http_client.get(self.url) as response:
-                content = await response.read()
-                return io.BytesIO(content)
+            async with http_client.get(self.url, headers=headers) as response:
+                if response.status == 304:
+                    return None
 
-    async def get_cities(self) -> AsyncIterable[CityData]:
-        excel_file = await self.download_excel_file()
-        workbook = load_workbook(filename=excel_file, read_only=True)
+                validators = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+                self.validators_path.write_text(json.dumps(validators))
+                # a 200 answer to a Range request means the server sent the whole file again
+                mode = 'ab' if response.status == 206 else 'wb'
+                with self.partial_path.open(mode) as partial_file:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        partial_file.write(chunk)
+
+        self.partial_path.replace(self.file_path)
+        return self.file_path
+
+    def _open_text(self, path: Path):
+        if path.suffix == '.gz':
+            return gzip.open(path, 'rt', encoding='utf-8', newline='')
+        return path.open('r', encoding='utf-8', newline='')
+
+    def _read_excel(self, path: Path) -> Iterator[CityData]:
+        workbook = load_workbook(filename=path, read_only=True)
         sheet = workbook.active
         # loop through all the rows
         for row in sheet.iter_rows(min_row=2, values_only=True):
             yield CityData(*row)
         workbook.close()
-        excel_file.close()
+
+    def _read_csv(self, path: Path) -> Iterator[CityData]:
+        """Read a CSV file with a ``name, lon, lat, country`` header."""
+        with self._open_text(path) as csv_file:
+            for row in csv.DictReader(csv_file):
+                yield CityData(row['name'], row['lon'], row['lat'], row['country'])
+
+    def _read_json(self, path: Path) -> Iterator[CityData]:
+        """Read a JSON city list in OpenWeather's ``city.list.json`` layout."""
+        with self._open_text(path) as json_file:
+            for city in json.load(json_file):
+                yield CityData(city['name'], city['coord']['lon'], city['coord']['lat'], city['country'])
+
+    def read_cities(self, path: Path) -> Iterator[CityData]:
+        suffixes = path.suffixes[-2:] if path.suffix == '.gz' else path.suffixes[-1:]
+        match suffixes[0] if suffixes else '':
+            case '.csv':
+                return self._read_csv(path)
+            case '.json':
+                return self._read_json(path)
+            case _:
+                return self._read_excel(path)
+
+    async def get_cities(self) -> AsyncIterable[CityData]:
+        path = await self.download_file()
+        if path is None:
+            if not self.force:
+                return
+            path = self.file_path
+        for city in self.read_cities(path):
+            yield city
+
+    async def get_city_chunks(self, size: int = 1000) -> AsyncIterable[list[CityData]]:
+        chunk = []
+        async for city in self.get_cities():
+            chunk.append(city)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Asynchronous token-bucket rate limiter shared by all loader workers.
+    attributes:
+        rate (float): Tokens added to the bucket per second.
+        capacity (float): Maximum number of tokens the bucket can hold.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, calls: int) -> 'TokenBucket':
+        """Build a bucket from a calls-per-minute quota, allowing bursts of one second worth of calls."""
+        return cls(rate=calls / 60)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Wait until ``tokens`` are available and take them from the bucket."""
+        async with self._lock:
+            while True:
+                if (pause := self._paused_until - time.monotonic()) > 0:
+                    await asyncio.sleep(pause)
+                    continue
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for ``seconds``, e.g. after the upstream sent ``Retry-After``."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated_at = time.monotonic()
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on the number of in-flight requests.
+    The limit grows by ``increase`` after every fast response and is multiplied
+    by ``decrease_factor`` on throttling or when a response is much slower
+    than the recent average.
+    attributes:
+        limit (int): The current number of requests allowed in flight.
+        minimum (int): The lowest the limit can shrink to.
+        maximum (int): The highest the limit can grow to.
+    """
+
+    def __init__(
+            self,
+            initial: int = 3,
+            minimum: int = 1,
+            maximum: int = 50,
+            increase: int = 1,
+            decrease_factor: float = 0.5,
+            latency_spike_factor: float = 2.0,
+    ) -> None:
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.average_latency: Optional[float] = None
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        """Record a successful response and adjust the limit."""
+        if self.average_latency is not None and latency > self.average_latency * self.latency_spike_factor:
+            self._decrease()
+        else:
+            self.limit = min(self.maximum, self.limit + self.increase)
+        self.average_latency = latency if self.average_latency is None else 0.8 * self.average_latency + 0.2 * latency
+
+    def on_throttle(self) -> None:
+        """Record a throttled response and shrink the limit."""
+        self._decrease()
+
+    def _decrease(self) -> None:
+        self.limit = max(self.minimum, int(self.limit * self.decrease_factor))
@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from django.conf import settings
+from django.utils import timezone
+from weatherapp.cache import aget_city_hits
+from weatherapp.models import City
+from .sharding import Shard
+from .weather_loader import WeatherLoader
+
+
+class RefreshScheduler:
+    """
+    Long-lived daemon that refreshes cities only when their data is due.
+    attributes:
+        loader (WeatherLoader): The loader used to fetch and store weather data.
+        refresh_interval (float): Seconds between refreshes of a city nobody asks for.
+        min_refresh_interval (float): Seconds between refreshes of the most popular cities.
+        hot_city_hits (int): API hits per day that halve a city's refresh interval.
+        resync_interval (float): Seconds between reloads of the schedule from the database.
+        shard (Optional[Shard]): The shard of the cities to refresh, all of them by default.
+        schedule (list[tuple[float, int]]): Heap of ``(next_due, city_id)`` pairs.
+
+    A city's next due time is its ``weather_updated_at`` plus its refresh
+    interval, or now if it was never refreshed. The interval shrinks with the
+    number of API hits the city got over the last day, down to
+    ``min_refresh_interval``.
+    """
+
+    def __init__(
+            self,
+            loader: WeatherLoader,
+            refresh_interval: float = 60 * 60,
+            min_refresh_interval: float = 10 * 60,
+            hot_city_hits: int = 100,
+            resync_interval: float = 10 * 60,
+            shard: Optional[Shard] = None,
+    ) -> None:
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.hot_city_hits = hot_city_hits
+        self.resync_interval = resync_interval
+        self.shard = shard
+        self.schedule: list[tuple[float, int]] = []
+
+    @classmethod
+    def from_settings(cls, loader: Optional[WeatherLoader], shard: Optional[Shard] = None) -> 'RefreshScheduler':
+        """The scheduler of ``populate_weathers --schedule``, with the refresh intervals of the settings."""
+        return cls(
+            loader,
+            refresh_interval=settings.WEATHER_REFRESH_INTERVAL_IN_MIN * 60,
+            min_refresh_interval=settings.WEATHER_MIN_REFRESH_INTERVAL_IN_MIN * 60,
+            shard=shard,
+        )
+
+    def get_refresh_interval(self, hits: int) -> float:
+        """Refresh interval in seconds for a city with the given number of API hits."""
+        return max(self.min_refresh_interval, self.refresh_interval / (1 + hits / self.hot_city_hits))
+
+    async def get_refresh_intervals(self, city_names: list[str]) -> dict[str, float]:
+        hits = await aget_city_hits(city_names)
+        return {name: self.get_refresh_interval(hits[name]) for name in city_names}
+
+    async def load_schedule(self) -> None:
+        """Rebuild the schedule from all active cities of the shard."""
+        cities = City.objects.filter(active=True).only('name', 'weather_updated_at')
+        if self.shard is not None:
+            cities = self.shard.filter(cities)
+        cities = [city async for city in cities]
+        intervals = await self.get_refresh_intervals([city.name for city in cities])
+        now, monotonic_now = timezone.now(), time.monotonic()
+
+        self.schedule = []
+        for city in cities:
+            if city.weather_updated_at is None:
+                self.schedule.append((monotonic_now, city.pk))
+                continue
+            next_due = city.weather_updated_at + timedelta(seconds=intervals[city.name])
+            self.schedule.append((monotonic_now + (next_due - now).total_seconds(), city.pk))
+        heapq.heapify(self.schedule)
+
+    def pop_due(self, limit: int = 1000) -> list[int]:
+        """Remove and return the IDs of up to ``limit`` cities that are due now."""
+        now = time.monotonic()
+        due = []
+        while self.schedule and self.schedule[0][0] <= now and len(due) < limit:
+            due.append(heapq.heappop(self.schedule)[1])
+        return due
+
+    async def refresh(self, city_ids: list[int]) -> None:
+        """Refresh the given cities and push them back with their next due time."""
+        await self.loader.run(City.objects.filter(pk__in=city_ids, active=True))
+
+        cities = [city async for city in City.objects.filter(pk__in=city_ids, active=True).only('name')]
+        intervals = await self.get_refresh_intervals([city.name for city in cities])
+        now = time.monotonic()
+        for city in cities:
+            heapq.heappush(self.schedule, (now + intervals[city.name], city.pk))
+
+    async def run_forever(self) -> None:
+        """Refresh due cities until cancelled."""
+        await self.load_schedule()
+        resync_at = time.monotonic() + self.resync_interval
+        while True:
+            if time.monotonic() >= resync_at:
+                await self.load_schedule()
+                resync_at = time.monotonic() + self.resync_interval
+
+            if due := self.pop_due():
+                await self.refresh(due)
+                continue
+
+            next_due = self.schedule[0][0] if self.schedule else resync_at
+            await asyncio.sleep(max(min(next_due, resync_at) - time.monotonic(), 0))
+
+
+async def aget_next_refreshes(last_modified: dict[str, datetime]) -> dict[str, datetime]:
+    """When ``populate_weathers --schedule`` refreshes each city next, from the time of its latest observation."""
+    intervals = await RefreshScheduler.from_settings(loader=None).get_refresh_intervals(list(last_modified))
+    return {city: timestamp + timedelta(seconds=intervals[city]) for city, timestamp in last_modified.items()}
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+from django.db.models import F, Q, QuerySet
+from django.utils import timezone
+from weatherapp.models import City
+from .weather_loader import WeatherLoader
+
+logger = logging.getLogger(__name__)
+
+# first key of the advisory locks on shards, so they do not collide with other advisory locks ('WEAT')
+SHARD_LOCK_NAMESPACE = 0x57454154
+MAX_SHARDS = 0x7fff
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    One of ``count`` disjoint subsets of the cities, by their ID modulo ``count``.
+    attributes:
+        index (int): The index of the shard, from 0 to ``count - 1``.
+        count (int): The number of shards the cities are split into.
+
+    City IDs are sequential, so the shards are of about the same size, and a city
+    stays in its shard as long as the number of shards does not change.
+    """
+    index: int
+    count: int
+
+    def __post_init__(self) -> None:
+        if not 0 < self.count <= MAX_SHARDS:
+            raise ValueError(f'The number of shards must be between 1 and {MAX_SHARDS}')
+        if not 0 <= self.index < self.count:
+            raise ValueError(f'The shard index must be between 0 and {self.count - 1}')
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.count}'
+
+    @classmethod
+    def parse(cls, value: str) -> 'Shard':
+        """Parse a shard given as ``'index/count'``, e.g. ``'0/4'``."""
+        index, _, count = value.partition('/')
+        if not (index.isdigit() and count.isdigit()):
+            raise ValueError(f"Invalid shard '{value}', expected INDEX/COUNT such as 0/4")
+        return cls(int(index), int(count))
+
+    @classmethod
+    def all(cls, count: int) -> list['Shard']:
+        return [cls(index, count) for index in range(max(count, 1))]  # a count below 1 raises
+
+    @property
+    def lock_key(self) -> int:
+        return self.count << 16 | self.index
+
+    def filter(self, cities: QuerySet) -> QuerySet:
+        """The cities of ``cities`` that belong to this shard."""
+        return cities.alias(shard=F('pk') % self.count).filter(shard=self.index)
+
+
+class ShardLockLost(Exception):
+    """Raised before a write once the advisory lock of a shard is no longer held."""
+
+
+class ShardLock:
+    """
+    Advisory lock of a shard, held on a database connection of its own.
+    attributes:
+        shard (Shard): The shard the lock is taken on.
+
+    The lock belongs to a database session, so it is free again once it is
+    released or its connection is gone, e.g. after a crash. Django's own
+    connections may be closed and reopened in the middle of a run, which would
+    silently drop a lock taken on them, so the lock gets a connection nothing
+    else uses, and ``acheck`` confirms it is still held before each write.
+    Without PostgreSQL, shards are not locked and always claimed.
+    """
+
+    def __init__(self, shard: Shard) -> None:
+        self.shard = shard
+        self._connection = None
+
+    def _acquire(self) -> bool:
+        if connection.vendor != 'postgresql':
+            return True
+        lock_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        with lock_connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [SHARD_LOCK_NAMESPACE, self.shard.lock_key])
+            claimed = cursor.fetchone()[0]
+        if claimed:
+            self._connection = lock_connection
+        else:
+            lock_connection.close()
+        return claimed
+
+    def _check(self) -> None:
+        if self._connection is None:
+            return
+        try:
+            with self._connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT 1 FROM pg_locks WHERE locktype = %s AND classid = %s AND objid = %s AND objsubid = 2 '
+                    'AND pid = pg_backend_pid() AND granted',
+                    ['advisory', SHARD_LOCK_NAMESPACE, self.shard.lock_key],
+                )
+                held = cursor.fetchone() is not None
+        except DatabaseError as exc:
+            raise ShardLockLost(f'Lost the connection holding shard {self.shard}') from exc
+        if not held:
+            raise ShardLockLost(f'Shard {self.shard} is no longer locked')
+
+    def _release(self) -> None:
+        if self._connection is None:
+            return
+        try:
+            # closing the session releases the lock as well, this only frees it sooner
+            with self._connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [SHARD_LOCK_NAMESPACE, self.shard.lock_key])
+        except DatabaseError:
+            pass
+        finally:
+            self._connection.close()
+            self._connection = None
+
+    async def aacquire(self) -> bool:
+        """Take the lock, unless another worker holds it."""
+        return await sync_to_async(self._acquire)()
+
+    async def acheck(self) -> None:
+        """Raise ShardLockLost if the lock was lost since it was taken."""
+        await sync_to_async(self._check)()
+
+    async def arelease(self) -> None:
+        await sync_to_async(self._release)()
+
+
+async def atry_claim(shard: Shard) -> Optional[ShardLock]:
+    """The lock of ``shard``, or None when another worker holds it."""
+    lock = ShardLock(shard)
+    return lock if await lock.aacquire() else None
+
+
+async def arefresh_shards(
+        loader: WeatherLoader,
+        shards: list[Shard],
+        claim_timeout: float = 10 * 60,
+        poll_interval: float = 5.0,
+) -> list[Shard]:
+    """Refresh the active cities of each of ``shards`` once it is claimed, and return the refreshed shards.
+
+    Several workers given the same shards split them between each other: a
+    shard held by another worker is skipped and tried again every
+    ``poll_interval`` seconds, for up to ``claim_timeout`` seconds. Only cities
+    not updated since this call started are refreshed, so a shard another
+    worker finished meanwhile costs a single query, while the cities left by a
+    worker that crashed are picked up. A shard left by a worker that crashed
+    after this call gave up on it is only refreshed by the next run.
+
+    The loader checks that the lock of the shard is still held before each
+    write, and a shard whose lock was lost is given up on, since another worker
+    may have claimed it in the meantime.
+    """
+    started_at = timezone.now()
+    not_updated = Q(weather_updated_at=None) | Q(weather_updated_at__lt=started_at)
+    deadline = time.monotonic() + claim_timeout
+    pending = list(shards)
+    refreshed = []
+    while True:
+        for shard in list(pending):
+            if (lock := await atry_claim(shard)) is None:
+                continue
+            pending.remove(shard)
+            loader.before_write = lock.acheck
+            try:
+                await loader.run(shard.filter(City.objects.filter(not_updated, active=True)))
+                refreshed.append(shard)
+            except* ShardLockLost:
+                logger.warning('Lost the lock of shard %s, giving up on it', shard)
+            finally:
+                loader.before_write = None
+                await lock.arelease()
+        if not pending:
+            break
+        if time.monotonic() >= deadline:
+            logger.warning('Gave up on shards %s, still claimed by other workers', ', '.join(map(str, pending)))
+            break
+        await asyncio.sleep(poll_interval)
+    return refreshed
@@ -1,5 +1,13 @@
 import asyncio
-from typing import Optional
+import logging
+import random
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional
+from django.db.models import QuerySet
+from django.utils import timezone
+from weatherapp import metrics
+from weatherapp.cache import ainvalidate_weather
 from weatherapp.models import City, WeatherData
 from openweather.client import OpenWeatherAPIClient
 from openweather.exceptions import (
@@ -10,6 +18,15 @@ from openweather.exceptions import (
     NotFoundError
 )
 from openweather.items import WeatherReport
+from .circuit_breaker import CircuitBreaker, FailurePolicy
+from .rate_limiter import TokenBucket, AdaptiveConcurrency
+
+logger = logging.getLogger(__name__)
+
+# timeouts, connection errors and 5xx usually pass within seconds
+NETWORK_FAILURES = FailurePolicy('network', failure_rate=0.5, min_requests=5, window=30, cool_down=5, max_cool_down=60)
+# a rejected API key does not heal by itself, so a single 401 opens the breaker for long
+AUTH_FAILURES = FailurePolicy('auth', max_failures=1, window=60, cool_down=600, max_cool_down=3600)
 
 
 class WeatherLoader:
@@ -17,82 +34,296 @@ class WeatherLoader:
     Asynchronous loader for weather data from the OpenWeather API.
     attributes:
         openweather_client (OpenWeatherAPIClient): The client to use for the requests.
-        cities (list[str]): A list of active cities to fetch weather data for.
-        request_queue (asyncio.Queue): A queue to hold the requests for weather data.
-        db_writer_queue (asyncio.Queue): A queue to hold the weather data to write to the database.
-        is_circuit_breaker_open (bool): A flag to indicate if the circuit breaker is open.
+        request_queue (asyncio.Queue): A bounded queue to hold batches of cities to fetch weather data for.
+        db_writer_queue (asyncio.Queue): A bounded queue to hold the weather data to write to the database.
+        circuit_breaker (CircuitBreaker): Breaker opened by network or auth failures, with a policy for each.
+        retry_queue (list[list[City]]): Batches of cities whose request failed, fetched again after the first pass.
+        max_retry_rounds (int): The number of passes over the retry queue after the first pass.
+        max_retry_wait (float): The longest a retry pass waits for the circuit breaker, in seconds.
+        rate_limiter (TokenBucket): Shared limiter sized from the plan's calls-per-minute quota.
+        concurrency (AdaptiveConcurrency): AIMD limit on the number of in-flight requests.
+        metrics_interval (float): Seconds between two samples of the queue depths and publishes of the metrics.
+        cities_written (int): The number of weather reports written by the current or last run.
+        cities_failed (int): The number of cities still in the retry queue at the end of the last run.
+        before_write (Optional[Callable]): Awaited before each batch is written, and raises to abort the run,
+            e.g. when the lock on the refreshed cities was lost.
+
+    Cities with a known OpenWeather ID are fetched in batches through the group
+    endpoint. Cities without one are fetched by their coordinates once, and the
+    ID found in the response is stored for the next runs.
+
+    A failed request, or one rejected by the open circuit breaker, puts its
+    cities on the retry queue instead of dropping them, and the queue is worked
+    off once the breaker lets requests through again.
     """
 
-    def __init__(self, client: OpenWeatherAPIClient) -> None:
+    def __init__(
+            self,
+            client: OpenWeatherAPIClient,
+            calls_per_minute: int = 60,
+            max_workers: int = 20,
+            max_retries: int = 5,
+            batch_size: int = 500,
+            flush_interval: float = 1.0,
+            city_chunk_size: int = 2000,
+            metrics_interval: float = 10.0,
+            network_policy: FailurePolicy = NETWORK_FAILURES,
+            auth_policy: FailurePolicy = AUTH_FAILURES,
+            max_retry_rounds: int = 3,
+            max_retry_wait: float = 120.0,
+            before_write: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
         self.openweather_client = client
-        self.request_queue = asyncio.Queue()
-        self.db_writer_queue = asyncio.Queue()
-        self.is_circuit_breaker_open = False
-
-    async def get_weather_by_city(self, city: str) -> Optional[WeatherReport]:
-        """Asynchronously fetch weather data for a given city."""
-
-        if self.is_circuit_breaker_open:
-            return None
-        try:
-            return await self.openweather_client.get_weather_by_city(city)
-        except TooManyRequestError:
-            # retry again after 60 seconds
-            await asyncio.sleep(60)
-            return await self.get_weather_by_city(city)
-        except (UnauthorizedError, UnexpectedError):
-            self.is_circuit_breaker_open = True
-            return None
-        except (InvalidResponse, NotFoundError):
-            return None
-
-    async def load_weather_data(self) -> None:
-        """Asynchronously load weather data for all active cities."""
-        async for city in City.objects.filter(active=True):
-            await self.request_queue.put(city.name)
+        self.request_queue = asyncio.Queue(maxsize=max_workers * 2)
+        self.db_writer_queue = asyncio.Queue(maxsize=batch_size * 2)
+        self.circuit_breaker = CircuitBreaker({UnexpectedError: network_policy, UnauthorizedError: auth_policy})
+        self.retry_queue: list[list[City]] = []
+        self.rate_limiter = TokenBucket.per_minute(calls_per_minute)
+        self.concurrency = AdaptiveConcurrency(maximum=max_workers)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.city_chunk_size = city_chunk_size
+        self.metrics_interval = metrics_interval
+        self.max_retry_rounds = max_retry_rounds
+        self.max_retry_wait = max_retry_wait
+        self.cities_written = 0
+        self.cities_failed = 0
+        self.before_write = before_write
+
+    @property
+    def is_circuit_breaker_open(self) -> bool:
+        return self.circuit_breaker.state != CircuitBreaker.CLOSED
+
+    @staticmethod
+    def get_backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+        """Exponential backoff with full jitter for the given retry attempt."""
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    async def fetch_weather_by_cities(self, cities: list[City]) -> list[tuple[City, WeatherReport]]:
+        """Make a single upstream request for a batch of cities.
+
+        Each report is paired with the City it was requested for, since the
+        upstream name of a location rarely matches the stored ``City.name``.
+        """
+
+        if len(cities) == 1 and cities[0].openweather_id is None:
+            city = cities[0]
+            report = await self.openweather_client.get_weather_by_lat_lon(city.latitude, city.longitude)
+            if report.city_id is not None:
+                await City.objects.filter(pk=city.pk).aupdate(openweather_id=report.city_id)
+            return [(city, report)]
+
+        reports = await self.openweather_client.get_weather_by_city_ids(city.openweather_id for city in cities)
+        cities_by_id = defaultdict(list)
+        for city in cities:
+            cities_by_id[city.openweather_id].append(city)
+        return [
+            (city, report)
+            for report in reports
+            for city in cities_by_id.get(report.city_id, [])
+        ]
+
+    async def get_weather_by_cities(self, cities: list[City]) -> Optional[list[tuple[City, WeatherReport]]]:
+        """Asynchronously fetch weather data for a batch of cities.
+
+        Requests are paced by the shared token bucket and the adaptive
+        concurrency limit. Throttled requests are retried after ``Retry-After``
+        or a jittered backoff, up to ``max_retries`` times. Returns None when the
+        batch should be retried later: the request failed, the circuit breaker
+        rejected it or it was still throttled after the last retry.
+        """
+
+        for attempt in range(self.max_retries + 1):
+            if not await self.circuit_breaker.allow():
+                return None
+            async with self.concurrency:
+                await self.rate_limiter.acquire()
+                started_at = time.monotonic()
+                try:
+                    reports = await self.fetch_weather_by_cities(cities)
+                except TooManyRequestError as exc:
+                    self.observe_request(started_at, 'throttled')
+                    self.circuit_breaker.record_throttled(exc.retry_after)
+                    metrics.THROTTLED.inc()
+                    self.concurrency.on_throttle()
+                    if exc.retry_after is not None:
+                        delay = exc.retry_after + random.uniform(0, 1)
+                        self.rate_limiter.pause(exc.retry_after)
+                    else:
+                        delay = self.get_backoff_delay(attempt)
+                except (UnauthorizedError, UnexpectedError) as exc:
+                    self.observe_request(started_at, 'error')
+                    self.circuit_breaker.record_failure(exc)
+                    return None
+                except (InvalidResponse, NotFoundError):
+                    self.observe_request(started_at, 'invalid')
+                    self.circuit_breaker.record_success()
+                    return []
+                else:
+                    self.observe_request(started_at, 'success')
+                    self.circuit_breaker.record_success()
+                    self.concurrency.on_success(time.monotonic() - started_at)
+                    return reports
+            await asyncio.sleep(delay)
+        return None
+
+    @staticmethod
+    def observe_request(started_at: float, outcome: str) -> None:
+        metrics.UPSTREAM_REQUEST_SECONDS.labels(outcome=outcome).observe(time.monotonic() - started_at)
+
+    async def load_weather_data(self, cities: Optional[QuerySet] = None) -> None:
+        """Asynchronously queue cities (all active ones by default), batched by the group endpoint limit.
+
+        Cities are streamed in chunks (through a server-side cursor on
+        PostgreSQL), so only a bounded number of rows is held at any time.
+        """
+        batch_size = self.openweather_client.GROUP_MAX_IDS
+        batch = []
+        if cities is None:
+            cities = City.objects.filter(active=True)
+        cities = cities.only('name', 'latitude', 'longitude', 'openweather_id')
+        async for city in cities.aiterator(chunk_size=self.city_chunk_size):
+            if city.openweather_id is None:
+                await self.request_queue.put([city])
+                continue
+            batch.append(city)
+            if len(batch) == batch_size:
+                await self.request_queue.put(batch)
+                batch = []
+        if batch:
+            await self.request_queue.put(batch)
 
     async def process_requests(self) -> None:
         """Asynchronously process requests from the queue."""
         while True:
-            city = await self.request_queue.get()
-            if city is None:
+            cities = await self.request_queue.get()
+            if cities is None:
+                self.request_queue.task_done()
                 break
-            print(f'process_requests {city}')
-            weather_report = await self.get_weather_by_city(city)
-            if weather_report:
-                await self.db_writer_queue.put(weather_report)
+            if (city_reports := await self.get_weather_by_cities(cities)) is None:
+                self.retry_queue.append(cities)
+                city_reports = []
+            for city_report in city_reports:
+                await self.db_writer_queue.put(city_report)
             self.request_queue.task_done()
 
+    async def write_batch(self, city_reports: list[tuple[City, WeatherReport]]) -> None:
+        """Asynchronously write a batch of weather reports in a single insert."""
+        if self.before_write is not None:
+            await self.before_write()
+        with metrics.DB_WRITE_SECONDS.time():
+            weather_data = await WeatherData.objects.abulk_insert([
+                WeatherData.from_weather_report(weather_report, city=city) for city, weather_report in city_reports
+            ])
+            await City.objects.filter(pk__in={city.pk for city, _ in city_reports}).aupdate(
+                weather_updated_at=timezone.now()
+            )
+        # the last observation of a city wins, as in its LatestWeather row
+        await ainvalidate_weather({city.name: data.timestamp for (city, _), data in zip(city_reports, weather_data)})
+        self.cities_written += len(city_reports)
+        metrics.CITIES_WRITTEN.inc(len(city_reports))
+        for _ in city_reports:
+            self.db_writer_queue.task_done()
+
     async def write_to_db(self) -> None:
-        """Asynchronously write weather data to the database."""
+        """Asynchronously write weather data to the database.
+
+        Reports are collected into batches that are flushed when they reach
+        ``batch_size`` or when the oldest report has waited ``flush_interval``
+        seconds, whichever comes first.
+        """
+        batch = []
+        deadline = None
         while True:
-            weather_report = await self.db_writer_queue.get()
-            if weather_report is None:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                city_report = await asyncio.wait_for(self.db_writer_queue.get(), timeout)
+            except TimeoutError:
+                await self.write_batch(batch)
+                batch, deadline = [], None
+                continue
+            if city_report is None:
+                if batch:
+                    await self.write_batch(batch)
+                self.db_writer_queue.task_done()
                 break
-            print(f'write_to_db {weather_report}')
-            weather_data = WeatherData.from_weather_report(weather_report)
-            await weather_data.asave()
-            self.db_writer_queue.task_done()
+            if not batch:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(city_report)
+            if len(batch) >= self.batch_size:
+                await self.write_batch(batch)
+                batch, deadline = [], None
 
-    async def run(self) -> None:
-        """Asynchronously run the weather loader."""
-        await self.load_weather_data()
+    async def retry_failed(self) -> None:
+        """Work off the retry queue in up to ``max_retry_rounds`` passes, once the previous pass is done.
 
-        api_tasks = []
-        for _ in range(3):
-            api_tasks.append(asyncio.create_task(self.process_requests()))
+        Each pass waits for the circuit breaker to let requests through again, unless
+        that takes longer than ``max_retry_wait``: the cities are then left for the
+        next run, e.g. after an auth failure.
+        """
+        for _ in range(self.max_retry_rounds):
+            await self.request_queue.join()
+            if not self.retry_queue or (wait := self.circuit_breaker.retry_in()) > self.max_retry_wait:
+                break
+            await asyncio.sleep(wait)
+            batches, self.retry_queue = self.retry_queue, []
+            metrics.CITIES_RETRIED.inc(sum(map(len, batches)))
+            for batch in batches:
+                await self.request_queue.put(batch)
         await self.request_queue.join()
 
-        db_tasks = []
-        for _ in range(5):
-            db_tasks.append(asyncio.create_task(self.write_to_db()))
-        await self.db_writer_queue.join()
+    def sample_queues(self) -> None:
+        metrics.QUEUE_DEPTH.labels(queue='request').set(self.request_queue.qsize())
+        metrics.QUEUE_DEPTH.labels(queue='db_writer').set(self.db_writer_queue.qsize())
+
+    async def report_metrics(self) -> None:
+        """Sample the queue depths and publish the metrics every ``metrics_interval`` seconds, until cancelled."""
+        while True:
+            self.sample_queues()
+            await metrics.apublish()
+            await asyncio.sleep(self.metrics_interval)
+
+    async def run(self, cities: Optional[QuerySet] = None) -> None:
+        """Asynchronously run the weather loader as a streaming pipeline.
+
+        The city producer, the fetch workers and the batch writer run
+        concurrently. Both queues are bounded, so a slow stage applies
+        backpressure upstream instead of piling reports up in memory. Each
+        stage is shut down by a ``None`` sentinel once its input and the retry
+        queue are exhausted.
+        """
+        self.cities_written = 0
+        self.retry_queue = []
+        started_at = time.monotonic()
+        async with asyncio.TaskGroup() as task_group:
+            metrics_task = task_group.create_task(self.report_metrics())
+            db_task = task_group.create_task(self.write_to_db())
+            api_tasks = [task_group.create_task(self.process_requests()) for _ in range(self.max_workers)]
 
-        for task in api_tasks:
-            task.cancel()
-        await asyncio.gather(*api_tasks, return_exceptions=True)
+            await self.load_weather_data(cities)
+            await self.retry_failed()
+            for _ in api_tasks:
+                await self.request_queue.put(None)
+            await asyncio.gather(*api_tasks)
 
-        for task in db_tasks:
-            task.cancel()
-        await asyncio.gather(*db_tasks, return_exceptions=True)
+            await self.db_writer_queue.put(None)
+            await db_task
+            metrics_task.cancel()
 
+        elapsed = time.monotonic() - started_at
+        self.cities_failed = sum(map(len, self.retry_queue))
+        self.sample_queues()
+        metrics.CITIES_FAILED.inc(self.cities_failed)
+        metrics.RUNS.inc()
+        metrics.LAST_RUN_SECONDS.set(elapsed)
+        metrics.LAST_RUN_CITIES.set(self.cities_written)
+        metrics.LAST_RUN_TIMESTAMP.set(time.time())
+        await metrics.apublish()
+        logger.info('Wrote %d weather reports in %.1fs', self.cities_written, elapsed)
+        if self.cities_failed:
+            logger.warning(
+                'Gave up on %d cities, left for the next run (circuit breaker %s)',
+                self.cities_failed, self.circuit_breaker.state,
+            )
@@ -1,9 +1,18 @@
 import aiohttp
 import asyncio
-from typing import Optional, Any, Never
-from .items import WeatherReport
+import json
+from typing import Optional, Any, Iterable, Never
+from .items import WeatherReport, WeatherReportBatch
 
-from .exceptions import UnauthorizedError, NotFoundError, TooManyRequestError, UnexpectedError
+from .exceptions import UnauthorizedError, NotFoundError, TooManyRequestError, UnexpectedError, InvalidResponse
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library decoder is used without it
+    orjson = None
+
+# both accept the raw body, so it is never decoded to a str first
+json_loads = orjson.loads if orjson is not None else json.loads
 
 
 class OpenWeatherAPIClient:
@@ -13,47 +22,126 @@ class OpenWeatherAPIClient:
         api_key (str): The API key for accessing the OpenWeatherMap API.
         unit (str): The unit system for temperature values (default is 'metric').
         version (str): The API version to use (default is '2.5').
+        base_url (str): The root URL of the API, pointed elsewhere for a local stand-in.
         endpoint (str): The base endpoint URL for weather data.
+        connection_limit (int): Maximum number of pooled connections per host.
+        keepalive_timeout (float): Seconds an idle pooled connection is kept open.
+        dns_cache_ttl (int): Seconds a resolved host address is cached.
+        connect_timeout (float): Seconds allowed for establishing a connection.
+        read_timeout (float): Seconds allowed between reads of the response.
+
+    The client keeps a single pooled ``aiohttp.ClientSession`` for its whole
+    lifetime. Use it as an async context manager so the pool is closed cleanly:
+
+        async with OpenWeatherAPIClient(api_key) as client:
+            await client.get_weather_by_city('dhaka')
     """
 
     BASE_URL = 'https://api.openweathermap.org/data'
+    GROUP_MAX_IDS = 20  # upstream limit of city IDs per group request
+    BOX_MAX_DEGREES = 5  # upstream limit of 25 square degrees per bounding box
 
     def __init__(
             self,
             api_key: str,
             unit: Optional[str] = 'metric',
-            version: Optional[str] = '2.5'
+            version: Optional[str] = '2.5',
+            base_url: str = BASE_URL,
+            connection_limit: int = 100,
+            keepalive_timeout: float = 30,
+            dns_cache_ttl: int = 300,
+            connect_timeout: float = 5,
+            read_timeout: float = 10,
     ):
         """Initialize the OpenWeatherAPIClient."""
         self.api_key = api_key
         self.unit = unit
         self.version = version
-        self.endpoint = f'{self.BASE_URL}/{self.version}/weather'
+        self.base_url = base_url
+        self.endpoint = f'{self.base_url}/{self.version}/weather'
+        self.group_endpoint = f'{self.base_url}/{self.version}/group'
+        self.box_endpoint = f'{self.base_url}/{self.version}/box/city'
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
 
-    async def _make_request(self, params: dict[str: Any]) -> WeatherReport:
-        """Make an asynchronous request to the OpenWeatherMap API."""
+    async def __aenter__(self) -> 'OpenWeatherAPIClient':
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def open(self) -> aiohttp.ClientSession:
+        """Create the pooled session if it is not open yet and return it."""
+
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.connection_limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self) -> None:
+        """Close the pooled session and release its connections."""
+
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _fetch_json(self, url: str, params: dict[str: Any]) -> dict[str, Any]:
+        """Make an asynchronous request to the OpenWeatherMap API and return the decoded body."""
 
         params.update({
             'units': self.unit,
             'appid': self.api_key,
         })
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(self.endpoint, params=params) as response:
-                    match response.status:
-                        case 200:
-                            response_json = await response.json()
-                            return WeatherReport.from_json_response(response_json)
-                        case 401:
-                            raise UnauthorizedError('Please provide a valid access token')
-                        case 404:
-                            raise NotFoundError('No report found for your queries')
-                        case 429:
-                            raise TooManyRequestError('You are making too many requests, please try again later')
-                        case _:
-                            raise UnexpectedError('Something unexpected happens, please contact the source')
-            except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
-                raise UnexpectedError('Something unexpected happens, please check your network')
+        session = await self.open()
+        try:
+            async with session.get(url, params=params) as response:
+                match response.status:
+                    case 200:
+                        try:
+                            return json_loads(await response.read())
+                        except ValueError:
+                            raise InvalidResponse('Response got from source is not valid.')
+                    case 401:
+                        raise UnauthorizedError('Please provide a valid access token')
+                    case 404:
+                        raise NotFoundError('No report found for your queries')
+                    case 429:
+                        raise TooManyRequestError(
+                            'You are making too many requests, please try again later',
+                            retry_after=_parse_retry_after(response.headers.get('Retry-After')),
+                        )
+                    case _:
+                        raise UnexpectedError('Something unexpected happens, please contact the source')
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+            raise UnexpectedError('Something unexpected happens, please check your network')
+
+    async def _make_request(self, params: dict[str: Any]) -> WeatherReport:
+        """Make an asynchronous request to the OpenWeatherMap API."""
+
+        response_json = await self._fetch_json(self.endpoint, params)
+        return WeatherReport.from_json_response(response_json)
+
+    async def _make_list_request(self, url: str, params: dict[str: Any]) -> WeatherReportBatch:
+        """Make a request to an endpoint answering with a ``list`` of reports.
+
+        Entries that fail validation are skipped so one corrupted city does not
+        discard the rest of the batch.
+        """
+
+        response_json = await self._fetch_json(url, params)
+        if not isinstance(items := response_json.get('list'), list):
+            raise InvalidResponse('Response got from source is not valid.')
+        return WeatherReportBatch.from_json_list(items)
 
     async def get_weather_by_city(self, city_name: str, lang: Optional[str] = 'en') -> WeatherReport:
         """Get weather data for a city by making an asynchronous API request."""
@@ -64,10 +152,77 @@ class OpenWeatherAPIClient:
     async def get_weather_by_lat_lon(self, lat: float, lon: float) -> WeatherReport:
         """Get weather data for a location by latitude and longitude."""
 
-        params = {'lat': lat, 'lon': lon}
+        # yarl truncates Decimal query values, such as City coordinates, to integers
+        params = {'lat': float(lat), 'lon': float(lon)}
         return await self._make_request(params)
 
+    async def get_weather_by_city_ids(self, city_ids: Iterable[int], lang: Optional[str] = 'en') -> WeatherReportBatch:
+        """Get weather data for many cities by their OpenWeather IDs.
+
+        IDs are sent to the group endpoint in chunks of ``GROUP_MAX_IDS``.
+        """
+
+        city_ids = list(city_ids)
+        chunks = [city_ids[i:i + self.GROUP_MAX_IDS] for i in range(0, len(city_ids), self.GROUP_MAX_IDS)]
+        results = await asyncio.gather(*(
+            self._make_list_request(self.group_endpoint, {'id': ','.join(map(str, chunk)), 'lang': lang})
+            for chunk in chunks
+        ))
+        return _merge(results)
+
+    async def get_weather_by_bbox(
+            self,
+            lon_left: float,
+            lat_bottom: float,
+            lon_right: float,
+            lat_top: float,
+            zoom: int = 10,
+            lang: Optional[str] = 'en'
+    ) -> WeatherReportBatch:
+        """Get weather data for all cities inside a bounding box.
+
+        Boxes wider or taller than ``BOX_MAX_DEGREES`` are split into tiles.
+        """
+
+        tiles = []
+        for lon in _split_range(lon_left, lon_right, self.BOX_MAX_DEGREES):
+            for lat in _split_range(lat_bottom, lat_top, self.BOX_MAX_DEGREES):
+                tiles.append((lon[0], lat[0], lon[1], lat[1]))
+        results = await asyncio.gather(*(
+            self._make_list_request(self.box_endpoint, {'bbox': f'{lo_l},{la_b},{lo_r},{la_t},{zoom}', 'lang': lang})
+            for lo_l, la_b, lo_r, la_t in tiles
+        ))
+        return _merge(results)
+
     async def get_weather(self, **kwargs) -> WeatherReport:
         """Get weather data by any query parameter."""
 
         return await self._make_request(kwargs)
+
+
+def _merge(batches: list[WeatherReportBatch]) -> WeatherReportBatch:
+    """Concatenate the batches answered by several requests."""
+
+    merged = WeatherReportBatch()
+    for batch in batches:
+        merged.extend(batch)
+    return merged
+
+
+def _split_range(start: float, end: float, step: float) -> list[tuple[float, float]]:
+    """Split ``[start, end]`` into consecutive intervals no longer than ``step``."""
+
+    bounds = []
+    while start < end:
+        bounds.append((start, min(start + step, end)))
+        start += step
+    return bounds or [(start, end)]
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header given in seconds; HTTP dates are ignored."""
+
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
@@ -10,7 +10,10 @@ class NotFoundError(Exception):
 
 class TooManyRequestError(Exception):
     """Exception raised when there are too many requests in a given time frame."""
-    pass
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 class UnexpectedError(Exception):
@@ -1,12 +1,36 @@
-from typing import Any
-from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+from dataclasses import dataclass, field, fields
 from .exceptions import InvalidResponse
 
-REQUIRED_FIELDS = ['name', 'main', 'wind']
-DICT_FIELDS = ['main', 'wind']
+MEASUREMENT_FIELDS = (
+    'temperature', 'min_temperature', 'max_temperature', 'humidity', 'pressure', 'wind_speed', 'wind_degree',
+)
 
 
-@dataclass
+def parse_report(json_data: dict[str, Any]) -> tuple:
+    """Validate and extract one report of an OpenWeatherMap API response in a single pass.
+
+    Returns the values in the field order of WeatherReport.
+    """
+    try:
+        main_dict, wind_dict = json_data['main'], json_data['wind']
+        return (
+            json_data['name'],
+            main_dict.get('temp'),
+            main_dict.get('temp_min'),
+            main_dict.get('temp_max'),
+            main_dict.get('humidity'),
+            main_dict.get('pressure'),
+            wind_dict.get('speed'),
+            wind_dict.get('deg'),
+            json_data.get('id'),
+        )
+    except (KeyError, TypeError, AttributeError):
+        # a missing field, or 'main' / 'wind' (or the item itself) not being a dictionary
+        raise InvalidResponse('Response got from source is not valid.') from None
+
+
+@dataclass(slots=True)
 class WeatherReport:
     """Represents a weather report."""
     city: str
@@ -17,41 +41,51 @@ class WeatherReport:
     pressure: int
     wind_speed: float
     wind_degree: int
+    city_id: Optional[int] = None
 
     @classmethod
     def from_json_response(cls, json_data: dict[str, Any]):
         """Create a WeatherReport instance from OpenWeatherMap API response."""
+        return cls(*parse_report(json_data))
 
-        if not (is_valid := cls.is_valid(json_data)):
-            raise InvalidResponse('Response got from source is not valid.')
 
-        # Extract individual dictionaries and handle potential null values
-        main_dict, wind_dict = json_data['main'], json_data['wind']
+@dataclass(slots=True)
+class WeatherReportBatch:
+    """
+    Many weather reports stored column by column, one list per WeatherReport field,
+    as answered by the group and box endpoints. Iterating yields WeatherReport objects.
+    """
+    city: list[str] = field(default_factory=list)
+    temperature: list[float] = field(default_factory=list)
+    min_temperature: list[float] = field(default_factory=list)
+    max_temperature: list[float] = field(default_factory=list)
+    humidity: list[int] = field(default_factory=list)
+    pressure: list[int] = field(default_factory=list)
+    wind_speed: list[float] = field(default_factory=list)
+    wind_degree: list[int] = field(default_factory=list)
+    city_id: list[Optional[int]] = field(default_factory=list)
+
+    @classmethod
+    def from_json_list(cls, items: list[dict[str, Any]]) -> 'WeatherReportBatch':
+        """Parse the ``list`` of an API response, skipping the entries that fail validation."""
+        rows = []
+        for item in items:
+            try:
+                rows.append(parse_report(item))
+            except InvalidResponse:
+                continue
+        return cls(*map(list, zip(*rows))) if rows else cls()
+
+    def _columns(self) -> list[list]:
+        return [getattr(self, report_field.name) for report_field in fields(self)]
+
+    def extend(self, other: 'WeatherReportBatch') -> None:
+        for column, other_column in zip(self._columns(), other._columns()):
+            column.extend(other_column)
+
+    def __len__(self) -> int:
+        return len(self.city)
 
-        # Create a validated_data dictionary with extracted values
-        data = {
-            'city': json_data['name'],
-            'temperature': main_dict.get('temp'),
-            'min_temperature': main_dict.get('temp_min'),
-            'max_temperature': main_dict.get('temp_max'),
-            'humidity': main_dict.get('humidity'),
-            'pressure': main_dict.get('pressure'),
-            'wind_speed': wind_dict.get('speed'),
-            'wind_degree': wind_dict.get('deg'),
-        }
-
-        return cls(**data)
-
-    @staticmethod
-    def is_valid(json_data: dict[str, Any]) -> bool:
-        """Validate data that got from the OpenWeatherMap API response."""
-
-        # Check if all required fields are present in json_data
-        if not all(key in json_data for key in REQUIRED_FIELDS):
-            return False
-
-        # Check if 'main', and 'wind' fields are dictionaries
-        if not all(isinstance(json_data[key], dict) for key in DICT_FIELDS):
-            return False
-
-        return True
+    def __iter__(self) -> Iterator[WeatherReport]:
+        for row in zip(*self._columns()):
+            yield WeatherReport(*row)
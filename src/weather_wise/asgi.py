@@ -7,10 +7,39 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import logging
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weather_wise.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from weatherapp.autocomplete import city_names  # noqa: E402
+from weatherapp.spatial import city_index  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+async def application(scope, receive, send):
+    """The Django application, which loads the in-memory city indexes on lifespan startup.
+
+    Django does not handle lifespan events, so they are answered here, and the
+    first coordinate or autocomplete request does not pay for loading every city.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await city_index.arefresh()
+                await city_names.arefresh()
+            except Exception:
+                # the indexes are loaded on first use instead, so the server still starts
+                logger.exception('Could not load the city indexes on startup.')
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
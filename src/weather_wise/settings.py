@@ -81,6 +81,20 @@ CACHES = {
     }
 }
 
+# Expired weather responses are still served for this long while they are refreshed
+WEATHER_CACHE_STALE_TIMEOUT = int(os.getenv('CACHE_STALE_TIMEOUT_IN_MIN', 5)) * 60  # in seconds
+# Per-process cache kept in front of the shared one
+WEATHER_LOCAL_CACHE_SIZE = int(os.getenv('LOCAL_CACHE_SIZE', 1024))
+WEATHER_LOCAL_CACHE_TIMEOUT = int(os.getenv('LOCAL_CACHE_TIMEOUT_IN_SEC', 5))  # in seconds
+# Upper bound of the cities answered by a single batch request
+WEATHER_BATCH_MAX_CITIES = int(os.getenv('WEATHER_BATCH_MAX_CITIES', 200))
+# How often every process picks up new, moved or deactivated cities for coordinate lookups
+WEATHER_CITY_INDEX_REFRESH_INTERVAL = int(os.getenv('CITY_INDEX_REFRESH_INTERVAL_IN_SEC', 60))
+# How often every process publishes its metrics to the shared cache for the /metrics endpoint
+METRICS_PUBLISH_INTERVAL = int(os.getenv('METRICS_PUBLISH_INTERVAL_IN_SEC', 10))
+# Bearer token required by the /metrics endpoint, which is open to anyone reaching the app when unset
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -134,3 +148,21 @@ SWEGGER_DOCS_PATH = os.path.join(BASE_DIR.parent, 'docs/openapi-spec.yml')
 
 
 OPEN_WEATHER_API_KEY = os.getenv('OPEN_WEATHER_API_KEY', 'your-secret-api-key')
+
+# Connection pool used by the OpenWeather client
+OPEN_WEATHER_CONNECTION_LIMIT = int(os.getenv('OPEN_WEATHER_CONNECTION_LIMIT', 100))  # per host
+OPEN_WEATHER_CONNECT_TIMEOUT = float(os.getenv('OPEN_WEATHER_CONNECT_TIMEOUT', 5))  # in seconds
+OPEN_WEATHER_READ_TIMEOUT = float(os.getenv('OPEN_WEATHER_READ_TIMEOUT', 10))  # in seconds
+OPEN_WEATHER_CALLS_PER_MINUTE = int(os.getenv('OPEN_WEATHER_CALLS_PER_MINUTE', 60))  # plan quota
+OPEN_WEATHER_MAX_WORKERS = int(os.getenv('OPEN_WEATHER_MAX_WORKERS', 20))  # upper bound of the adaptive worker count
+
+# Refresh intervals used by `populate_weathers --schedule`
+WEATHER_REFRESH_INTERVAL_IN_MIN = int(os.getenv('WEATHER_REFRESH_INTERVAL_IN_MIN', 60))
+WEATHER_MIN_REFRESH_INTERVAL_IN_MIN = int(os.getenv('WEATHER_MIN_REFRESH_INTERVAL_IN_MIN', 10))  # for popular cities
+
+# How long `populate_weathers --shard/--shards` waits for shards claimed by other workers
+WEATHER_SHARD_CLAIM_TIMEOUT_IN_MIN = int(os.getenv('WEATHER_SHARD_CLAIM_TIMEOUT_IN_MIN', 10))
+
+# Retention used by `manage_weather_history`; daily aggregates are kept forever
+WEATHER_RAW_RETENTION_MONTHS = int(os.getenv('WEATHER_RAW_RETENTION_MONTHS', 3))
+WEATHER_HOURLY_RETENTION_MONTHS = int(os.getenv('WEATHER_HOURLY_RETENTION_MONTHS', 24))
@@ -4,12 +4,14 @@ from .models import WeatherData, City
 
 class WeatherDataAdmin(admin.ModelAdmin):
     list_display = ('city', 'temperature', 'humidity', 'pressure', 'wind_speed', 'wind_direction', 'timestamp')
-    search_fields = ('city',)
-    list_filter = ('city', 'timestamp')
+    list_select_related = ('city',)
+    search_fields = ('city__name',)
+    list_filter = ('timestamp',)
+    raw_id_fields = ('city',)
 
 
 class CityAdmin(admin.ModelAdmin):
-    list_display = ('name', 'country', 'latitude', 'longitude', 'active', 'last_update')
+    list_display = ('name', 'country', 'latitude', 'longitude', 'active', 'last_update', 'weather_updated_at')
     search_fields = ('name', 'country')
     list_filter = ('country',)
 
@@ -0,0 +1,131 @@
+import bisect
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import CITY_NAMES_VERSION_KEY
+from .models import City
+
+
+def trigrams(text: str) -> set[str]:
+    """Trigrams of a lowercase string, padded like pg_trgm so word starts weigh more."""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CityNameIndex:
+    """
+    Names of all cities held in memory for autocomplete: a sorted array answers
+    prefix queries with a binary search, and trigram posting lists answer
+    misspelled ones by similarity.
+    attributes:
+        refresh_interval (float): Seconds between two checks whether the city list changed.
+        similarity (float): The minimum trigram similarity of a fuzzy match, between 0 and 1.
+        max_postings (int): The number of postings a fuzzy lookup scans at most, bounding its latency.
+        max_candidates (int): The number of names a fuzzy lookup scores exactly.
+    """
+
+    def __init__(
+        self, refresh_interval: float, similarity: float = 0.3, max_postings: int = 10000, max_candidates: int = 100
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.similarity = similarity
+        self.max_postings = max_postings
+        self.max_candidates = max_candidates
+        self._names: list[str] = []
+        self._countries: list[str] = []
+        self._trigram_counts = array('H')
+        self._postings: dict[str, array] = {}
+        self._version: Optional[int] = None
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def build(self, rows: list[tuple[str, str]]) -> None:
+        """Index ``(name, country)`` rows, sorted by name."""
+        postings: dict[str, list[int]] = {}
+        trigram_counts = array('H')
+        for position, (name, _country) in enumerate(rows):
+            grams = trigrams(name)
+            trigram_counts.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+
+        self._names = [name for name, _country in rows]
+        self._countries = [country for _name, country in rows]
+        self._trigram_counts = trigram_counts
+        self._postings = {gram: array('I', positions) for gram, positions in postings.items()}
+
+    def refresh(self) -> None:
+        """Rebuild the index when it was never built or ``populate_contries`` changed the cities since."""
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.refresh_interval:
+                return
+            version = cache.get(CITY_NAMES_VERSION_KEY)
+            if self._checked_at is None or version != self._version:
+                self.build(list(City.objects.order_by('name').values_list('name', 'country')))
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    async def arefresh(self) -> None:
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.refresh_interval:
+            await sync_to_async(self.refresh)()
+
+    def clear(self) -> None:
+        """Drop the index, so the next refresh builds it again."""
+        with self._lock:
+            self.build([])
+            self._version = self._checked_at = None
+
+    def prefix(self, query: str, limit: int) -> list[int]:
+        """Positions of the names starting with ``query``, in alphabetical order."""
+        start = bisect.bisect_left(self._names, query)
+        end = min(bisect.bisect_left(self._names, query + '\U0010ffff', lo=start), start + limit)
+        return list(range(start, end))
+
+    def fuzzy(self, query: str, limit: int) -> list[int]:
+        """Positions of the names most similar to ``query`` by shared trigrams, best match first.
+
+        Posting lists are scanned from the rarest trigram on, within a budget of
+        ``max_postings``: rare trigrams tell names apart, while common ones such as
+        those of " city" mostly cost time. The names sharing the most scanned
+        trigrams are then scored exactly.
+        """
+        grams = trigrams(query)
+        shared = Counter()
+        budget = self.max_postings
+        for positions in sorted((self._postings[gram] for gram in grams if gram in self._postings), key=len):
+            if shared and len(positions) > budget:
+                break
+            shared.update(positions)
+            budget -= len(positions)
+
+        matches = []
+        for position, _count in shared.most_common(self.max_candidates):
+            count = len(grams & trigrams(self._names[position]))
+            similarity = count / (len(grams) + self._trigram_counts[position] - count)
+            if similarity >= self.similarity:
+                matches.append((-similarity, position))
+        matches.sort()
+        return [position for _similarity, position in matches[:limit]]
+
+    def suggest(self, query: str, limit: int) -> list[dict[str, str]]:
+        """Cities whose name starts with ``query``, topped up with fuzzy matches for misspellings."""
+        query = query.strip().lower()
+        positions = self.prefix(query, limit)
+        if len(positions) < limit:
+            positions += [position for position in self.fuzzy(query, 2 * limit) if position not in positions]
+        return [
+            {'name': self._names[position], 'country': self._countries[position]} for position in positions[:limit]
+        ]
+
+    async def asuggest(self, query: str, limit: int) -> list[dict[str, str]]:
+        await self.arefresh()
+        return self.suggest(query, limit)
+
+
+city_names = CityNameIndex(refresh_interval=settings.WEATHER_CITY_INDEX_REFRESH_INTERVAL)
@@ -0,0 +1,55 @@
+"""
+Copy WeatherData rows from the pre-compaction columns (added by migration 0007)
+into the compact ones, in primary-key ranges, so no statement holds locks on
+more than ``batch_size`` rows at a time.
+"""
+from typing import Iterator
+from django.utils import timezone
+
+TABLE = 'weatherapp_weatherdata'
+CITY_TABLE = 'weatherapp_city'
+
+MISSING_CITIES_SQL = f'''
+SELECT DISTINCT LOWER(city_name) FROM {TABLE}
+WHERE city_id IS NULL AND LOWER(city_name) NOT IN (SELECT name FROM {CITY_TABLE})
+'''
+
+BACKFILL_SQL = f'''
+UPDATE {TABLE} SET
+    city_id = (SELECT id FROM {CITY_TABLE} WHERE {CITY_TABLE}.name = LOWER({TABLE}.city_name)),
+    temperature = ROUND(temperature_legacy * 100),
+    min_temperature = ROUND(min_temperature_legacy * 100),
+    max_temperature = ROUND(max_temperature_legacy * 100),
+    humidity = humidity_legacy,
+    pressure = pressure_legacy,
+    wind_speed = ROUND(wind_speed_legacy * 100),
+    wind_degree = wind_degree_legacy
+WHERE id >= %s AND id < %s AND city_id IS NULL
+'''
+
+
+def create_missing_cities(connection) -> int:
+    """Create an inactive City for every name in the history that has none, so every row gets a foreign key."""
+    with connection.cursor() as cursor:
+        cursor.execute(MISSING_CITIES_SQL)
+        names = [row[0] for row in cursor.fetchall()]
+        cursor.executemany(
+            f'INSERT INTO {CITY_TABLE} (name, country, latitude, longitude, active, last_update) '
+            'VALUES (%s, %s, 0, 0, %s, %s)',
+            [(name, '', False, timezone.now()) for name in names],
+        )
+    return len(names)
+
+
+def backfill_compact_weather(connection, batch_size: int = 10000) -> Iterator[tuple[int, int, int]]:
+    """Backfill the compact columns and yield ``(last_id, max_id, rows_updated)`` after every batch."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(id), MAX(id) FROM {TABLE} WHERE city_id IS NULL')
+        min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return
+
+    for start in range(min_id, max_id + 1, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(BACKFILL_SQL, [start, start + batch_size])
+            yield min(start + batch_size - 1, max_id), max_id, cursor.rowcount
@@ -0,0 +1,277 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone, translation
+
+from . import metrics
+
+# bump when the cached response layout changes, so stale entries are never served
+WEATHER_CACHE_VERSION = 4
+WEATHER_KEY = 'weather:v{version}:{lang}:{city}'
+CITY_HITS_KEY = 'city-hits:{day}:{city}'
+CITY_HITS_TIMEOUT = 2 * 24 * 60 * 60  # the count of a day is read until the next one ends
+CITY_NAMES_VERSION_KEY = 'city-names-version'
+WEATHER_MODIFIED_KEY = 'weather-modified:{}'
+WEATHER_MODIFIED_TIMEOUT = 24 * 60 * 60  # renewed by every write of weather data for the city
+
+
+class CachedResponse(NamedTuple):
+    """Serialized weather response, with the time of the observation it was built from and of its next refresh."""
+    content: bytes
+    last_modified: datetime
+    next_refresh: datetime
+
+
+def city_hits_key(city: str, day: date) -> str:
+    return CITY_HITS_KEY.format(day=day.isoformat(), city=city.lower())
+
+
+async def arecord_city_hit(city: str) -> None:
+    """Count an API request for the given city, in the counter of the current day."""
+    key = city_hits_key(city, timezone.now().date())
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        # the first hit of the day; another process may have counted its own first hit meanwhile
+        if not await cache.aadd(key, 1, timeout=CITY_HITS_TIMEOUT):
+            await cache.aincr(key)
+
+
+async def aget_city_hits(cities: list[str]) -> dict[str, int]:
+    """Return the number of API requests counted for each of the given cities over the last 24 hours.
+
+    Hits are counted per day, so the count of the previous day is weighted by
+    the part of it that still falls within the last 24 hours.
+    """
+    now = timezone.now()
+    today, yesterday = now.date(), now.date() - timedelta(days=1)
+    weight = 1 - (now - now.replace(hour=0, minute=0, second=0, microsecond=0)) / timedelta(days=1)
+    hits = await cache.aget_many([city_hits_key(city, day) for city in cities for day in (today, yesterday)])
+    return {
+        city: round(hits.get(city_hits_key(city, today), 0) + weight * hits.get(city_hits_key(city, yesterday), 0))
+        for city in cities
+    }
+
+
+async def abump_city_names_version() -> None:
+    """Tell every process that the city list changed, so their in-memory name indexes are rebuilt."""
+    await cache.aset(CITY_NAMES_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def weather_cache_key(city: str, lang: str | None = None) -> str:
+    """Cache key of the serialized weather response for a city in a language (the active one by default)."""
+    lang = translation.get_supported_language_variant(lang or translation.get_language() or settings.LANGUAGE_CODE)
+    return WEATHER_KEY.format(version=WEATHER_CACHE_VERSION, lang=lang, city=city.lower())
+
+
+def weather_cache_keys(city: str) -> list[str]:
+    """Cache keys of the serialized weather response for a city in every supported language."""
+    return [weather_cache_key(city, lang) for lang, _ in settings.LANGUAGES]
+
+
+def weather_modified_key(city: str) -> str:
+    return WEATHER_MODIFIED_KEY.format(city.lower())
+
+
+async def aget_weather_modified(city: str) -> Optional[datetime]:
+    """The time of the latest observation of a city, without loading its response, None when it is not cached."""
+    return await cache.aget(weather_modified_key(city))
+
+
+async def aadd_weather_modified(city: str, last_modified: datetime) -> None:
+    """Cache the time of the latest observation of a city read from the database, unless a newer write did."""
+    await cache.aadd(weather_modified_key(city), last_modified, timeout=WEATHER_MODIFIED_TIMEOUT)
+
+
+async def ainvalidate_weather(last_modified: dict[str, datetime]) -> None:
+    """Drop the cached responses of the given cities after new weather data landed.
+
+    ``last_modified`` maps every city to the time of its new observation, which
+    is cached on its own so revalidations are answered without the response.
+    """
+    await cache.aset_many(
+        {weather_modified_key(city): timestamp for city, timestamp in last_modified.items()},
+        timeout=WEATHER_MODIFIED_TIMEOUT,
+    )
+    keys = [key for city in last_modified for key in weather_cache_keys(city)]
+    for key in keys:
+        local_cache.delete(key)
+    await cache.adelete_many(keys)
+
+
+class LocalCache:
+    """
+    Small per-process LRU cache with a short TTL, kept in front of the shared cache.
+    attributes:
+        maxsize (int): The maximum number of entries kept.
+        timeout (float): Seconds an entry is served before it expires.
+    """
+
+    def __init__(self, maxsize: int, timeout: float) -> None:
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        if (entry := self._entries.get(key)) is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.timeout, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+local_cache = LocalCache(maxsize=settings.WEATHER_LOCAL_CACHE_SIZE, timeout=settings.WEATHER_LOCAL_CACHE_TIMEOUT)
+_in_flight: dict[str, asyncio.Future] = {}
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _load_and_store(
+    key: str, load: Callable[[], Awaitable[Optional[CachedResponse]]]
+) -> Optional[CachedResponse]:
+    """Load a value once per key, however many requests are waiting for it, and cache it."""
+    if (future := _in_flight.get(key)) is not None:
+        return await asyncio.shield(future)
+
+    future = _in_flight[key] = asyncio.get_running_loop().create_future()
+    try:
+        value = await load()
+        if value is not None:
+            timeout = cache.default_timeout
+            # kept past its freshness for the stale window, so hot keys never block on a refresh
+            await cache.aset(
+                key, (time.time() + timeout, value), timeout=timeout + settings.WEATHER_CACHE_STALE_TIMEOUT
+            )
+            local_cache.set(key, value)
+        future.set_result(value)
+        return value
+    except BaseException as exc:
+        future.set_exception(exc)
+        # retrieve the exception so a future nobody else waits on is not reported as never retrieved
+        future.exception()
+        raise
+    finally:
+        del _in_flight[key]
+
+
+async def aget_or_load(key: str, load: Callable[[], Awaitable[Optional[CachedResponse]]]) -> Optional[CachedResponse]:
+    """Get a value from the local tier, then the shared cache, and only then from ``load``.
+
+    Concurrent misses for the same key share one call to ``load``. A stale entry
+    of the shared cache is served as-is while it is refreshed in the background.
+    """
+    if (value := local_cache.get(key)) is not None:
+        metrics.CACHE_LOOKUPS.labels(result='local_hit').inc()
+        return value
+
+    if (entry := await cache.aget(key)) is not None:
+        fresh_until, value = entry
+        if fresh_until < time.time() and key not in _in_flight:
+            metrics.CACHE_LOOKUPS.labels(result='stale_hit').inc()
+            task = asyncio.create_task(_load_and_store(key, load))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        else:
+            metrics.CACHE_LOOKUPS.labels(result='shared_hit').inc()
+        local_cache.set(key, value)
+        return value
+
+    metrics.CACHE_LOOKUPS.labels(result='miss').inc()
+    return await _load_and_store(key, load)
+
+
+async def _load_many_and_store(
+    keys: dict[str, str], load_many: Callable[[list[str]], Awaitable[dict[str, Optional[CachedResponse]]]]
+) -> dict[str, Optional[CachedResponse]]:
+    """Load the values of many items with one call to ``load_many`` and cache them.
+
+    ``keys`` maps every item to its cache key. Items already being loaded by
+    another request wait for that load instead of being loaded twice.
+    """
+    waiting = {item: _in_flight[key] for item, key in keys.items() if key in _in_flight}
+    owned = {item: key for item, key in keys.items() if item not in waiting}
+    loop = asyncio.get_running_loop()
+    futures = {item: _in_flight.setdefault(key, loop.create_future()) for item, key in owned.items()}
+
+    try:
+        values = await load_many(list(owned)) if owned else {}
+        found = {key: values.get(item) for item, key in owned.items() if values.get(item) is not None}
+        if found:
+            timeout = cache.default_timeout
+            await cache.aset_many(
+                {key: (time.time() + timeout, value) for key, value in found.items()},
+                timeout=timeout + settings.WEATHER_CACHE_STALE_TIMEOUT,
+            )
+            for key, value in found.items():
+                local_cache.set(key, value)
+        for item, future in futures.items():
+            future.set_result(values.get(item))
+    except BaseException as exc:
+        for future in futures.values():
+            future.set_exception(exc)
+            future.exception()
+        raise
+    finally:
+        for key in owned.values():
+            del _in_flight[key]
+
+    for item, future in waiting.items():
+        values[item] = await asyncio.shield(future)
+    return values
+
+
+async def aget_or_load_many(
+    keys: dict[str, str], load_many: Callable[[list[str]], Awaitable[dict[str, Optional[CachedResponse]]]]
+) -> dict[str, Optional[CachedResponse]]:
+    """Get the values of many items at once, the batch counterpart of ``aget_or_load``.
+
+    ``keys`` maps every item to its cache key. Local misses are fetched from the
+    shared cache with a single ``get_many``, and the remaining misses are loaded
+    with a single call to ``load_many``, which returns the value of every item it
+    found.
+    """
+    values = {item: local_cache.get(key) for item, key in keys.items()}
+    missing = {item: key for item, key in keys.items() if values[item] is None}
+    metrics.CACHE_LOOKUPS.labels(result='local_hit').inc(len(keys) - len(missing))
+    if not missing:
+        return values
+
+    entries = await cache.aget_many(list(missing.values()))
+    stale = {}
+    for item, key in list(missing.items()):
+        if (entry := entries.get(key)) is None:
+            continue
+        fresh_until, values[item] = entry
+        if fresh_until < time.time() and key not in _in_flight:
+            stale[item] = key
+        local_cache.set(key, values[item])
+        del missing[item]
+
+    metrics.CACHE_LOOKUPS.labels(result='shared_hit').inc(len(entries) - len(stale))
+    metrics.CACHE_LOOKUPS.labels(result='stale_hit').inc(len(stale))
+    metrics.CACHE_LOOKUPS.labels(result='miss').inc(len(missing))
+    if stale:
+        task = asyncio.create_task(_load_many_and_store(stale, load_many))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    if missing:
+        values.update(await _load_many_and_store(missing, load_many))
+    return values
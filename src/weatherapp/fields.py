@@ -0,0 +1,46 @@
+from decimal import Decimal
+from django.db import models
+
+
+class ScaledIntegerField(models.IntegerField):
+    """
+    Stores a decimal value as an integer scaled by ``10 ** decimal_places``.
+    A temperature of 21.37 is stored as 2137 instead of a numeric column, and
+    read back as ``Decimal('21.37')``.
+
+    The column is a small integer of two bytes by default, so with two decimal
+    places it holds -327.68 to 327.67: enough for wind speeds in m/s, but not
+    for temperatures in Kelvin, which need ``small=False`` for a four byte
+    integer.
+    """
+
+    def __init__(self, *args, decimal_places: int = 2, small: bool = True, **kwargs):
+        self.decimal_places = decimal_places
+        self.small = small
+        super().__init__(*args, **kwargs)
+
+    def get_internal_type(self):
+        return 'SmallIntegerField' if self.small else 'IntegerField'
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.decimal_places != 2:
+            kwargs['decimal_places'] = self.decimal_places
+        if not self.small:
+            kwargs['small'] = False
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(value).scaleb(-self.decimal_places)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        return Decimal(str(value))
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return int(Decimal(str(value)).scaleb(self.decimal_places).to_integral_value())
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from weatherapp.backfill import backfill_compact_weather, create_missing_cities
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy weather history into the compact columns in small batches. Run it between '
+        '`migrate weatherapp 0007` and `migrate` on large tables, so the final migration has nothing left to copy'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of ids updated per statement')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        if created := create_missing_cities(connection):
+            self.stdout.write(f'Created {created} inactive cities found only in the weather history')
+
+        started_at = time.monotonic()
+        total = 0
+        for last_id, max_id, updated in backfill_compact_weather(connection, batch_size=options['batch_size']):
+            total += updated
+            elapsed = time.monotonic() - started_at
+            self.stdout.write(f'{total} rows backfilled, up to id {last_id} of {max_id} ({total / elapsed:.0f} rows/s)')
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully backfilled {total} weather rows'))
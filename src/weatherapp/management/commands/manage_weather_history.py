@@ -0,0 +1,143 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from weatherapp.models import WeatherAggregate, WeatherData
+
+TABLE = WeatherData._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_(\d{{4}})_(\d{{2}})$')
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Maintain the weather history: create upcoming monthly partitions, roll expired raw data up into '
+        'hourly and daily aggregates, then drop or archive it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--premake', type=int, default=3, help='Number of future monthly partitions to create')
+        parser.add_argument(
+            '--retention', type=int, default=settings.WEATHER_RAW_RETENTION_MONTHS,
+            help='Months of raw weather data to keep'
+        )
+        parser.add_argument(
+            '--hourly-retention', type=int, default=settings.WEATHER_HOURLY_RETENTION_MONTHS,
+            help='Months of hourly aggregates to keep; daily aggregates are kept forever'
+        )
+        parser.add_argument(
+            '--archive', action='store_true',
+            help='Detach expired partitions and keep them as standalone tables instead of dropping them'
+        )
+
+    def handle(self, *args, **options):
+        now = month_start(timezone.now())
+        raw_cutoff = add_months(now, -options['retention'])
+
+        if connection.vendor == 'postgresql':
+            self.create_partitions(until=add_months(now, options['premake'] + 1))
+            self.expire_partitions(raw_cutoff, archive=options['archive'])
+        else:
+            self.expire_rows(raw_cutoff)
+
+        hourly_cutoff = add_months(now, -options['hourly_retention'])
+        deleted, _ = WeatherAggregate.objects.filter(period=WeatherAggregate.HOUR, bucket__lt=hourly_cutoff).delete()
+        self.stdout.write(f'Deleted {deleted} hourly aggregates older than {hourly_cutoff:%Y-%m}')
+        self.stdout.write(self.style.SUCCESS('Successfully maintained the weather history'))
+
+    def downsample(self, start: datetime, end: datetime) -> None:
+        hourly = WeatherAggregate.objects.downsample(WeatherAggregate.HOUR, start, end)
+        daily = WeatherAggregate.objects.downsample(WeatherAggregate.DAY, start, end)
+        self.stdout.write(f'Rolled {start:%Y-%m} up into {hourly} hourly and {daily} daily aggregates')
+
+    def get_partitions(self) -> dict[datetime, str]:
+        """Return the monthly partitions of the weather table by the month they hold."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'WHERE parent.relname = %s',
+                [TABLE],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        partitions = {}
+        for name in names:
+            if match := PARTITION_NAME.match(name):
+                partitions[datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)] = name
+        return partitions
+
+    def create_partitions(self, until: datetime) -> None:
+        """Create every missing monthly partition up to ``until``.
+
+        Partitions start with the month of the oldest row of the default partition.
+        Rows already sitting in the default partition are moved into the new
+        partition, since PostgreSQL refuses to attach a range the default
+        partition holds rows for.
+        """
+        partitions = self.get_partitions()
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT MIN("timestamp") FROM {DEFAULT_PARTITION}')
+            oldest = cursor.fetchone()[0]
+        month = month_start(min(oldest, timezone.now())) if oldest else month_start(timezone.now())
+
+        while month < until:
+            if month not in partitions:
+                self.create_partition(month, add_months(month, 1))
+            month = add_months(month, 1)
+
+    def create_partition(self, start: datetime, end: datetime) -> None:
+        name = f'{TABLE}_{start:%Y_%m}'
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= %s AND "timestamp" < %s '
+                f'RETURNING *) INSERT INTO {name} SELECT * FROM moved',
+                [start, end],
+            )
+            moved = cursor.rowcount
+            cursor.execute(
+                f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        moved_rows = f' with {moved} rows from the default partition' if moved else ''
+        self.stdout.write(f'Created partition {name}{moved_rows}')
+
+    def expire_partitions(self, cutoff: datetime, archive: bool) -> None:
+        """Roll up, then drop or detach, every monthly partition that ends before ``cutoff``."""
+        for month, name in sorted(self.get_partitions().items()):
+            if add_months(month, 1) > cutoff:
+                continue
+            self.downsample(month, add_months(month, 1))
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+                if archive:
+                    cursor.execute(f'ALTER TABLE {name} RENAME TO {name}_archived')
+                else:
+                    cursor.execute(f'DROP TABLE {name}')
+            self.stdout.write(f'{"Archived" if archive else "Dropped"} partition {name}')
+
+    def expire_rows(self, cutoff: datetime, batch_size: int = 10000) -> None:
+        """Roll up and delete raw rows older than ``cutoff`` on databases without partitioning."""
+        if not (oldest := WeatherData.objects.filter(timestamp__lt=cutoff).order_by('timestamp').first()):
+            return
+        month = month_start(oldest.timestamp)
+        while month < cutoff:
+            self.downsample(month, add_months(month, 1))
+            month = add_months(month, 1)
+
+        deleted = 0
+        while ids := list(WeatherData.objects.filter(timestamp__lt=cutoff).values_list('id', flat=True)[:batch_size]):
+            deleted += WeatherData.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(f'Deleted {deleted} weather rows older than {cutoff:%Y-%m}')
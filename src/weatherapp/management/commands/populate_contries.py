@@ -1,38 +1,97 @@
 import asyncio
+import time
+from decimal import Decimal
 from django.core.management.base import BaseCommand
+from weatherapp.cache import abump_city_names_version
 from weatherapp.models import City
 
-from loader.city_loader import CityLoader
+from loader.city_loader import CityData, CityLoader
+
+COORDINATE_PRECISION = Decimal('0.000001')  # matches City.latitude / City.longitude
+
+
+def row_fingerprint(country, latitude, longitude) -> tuple[str, Decimal, Decimal]:
+    """Normalize a row the way it is stored, so incoming and stored rows compare equal."""
+    return (
+        str(country),
+        Decimal(str(latitude)).quantize(COORDINATE_PRECISION),
+        Decimal(str(longitude)).quantize(COORDINATE_PRECISION),
+    )
 
 
 class Command(BaseCommand):
-    help = 'Populate the database with cities from an Excel file'
+    help = 'Populate the database with cities from an Excel, CSV or JSON file'
     url = 'https://openweathermap.org/storage/app/media/cities_list.xlsx'
-    override = False
-    loader = CityLoader(url, override=override)
+    chunk_size = 1000
 
     def add_arguments(self, parser):
-        parser.add_argument('--override', action='store_true', help='Override the existing data in the database')
-
-    async def load_cities(self) -> None:
-        async for city in self.loader.get_cities():
-            city_name = city.name.lower()
-            try:
-                city = await City.objects.aget(name=city_name)
-                if self.loader.override:
-                    city.country = city.country
-                    city.latitude = city.lat
-                    city.longitude = city.lon
-                    await city.asave()
-            except City.DoesNotExist:
-                await City.objects.acreate(
-                    name=city_name,
-                    country=city.country,
-                    latitude=city.lat,
-                    longitude=city.lon,
+        parser.add_argument(
+            '--override', action='store_true',
+            help='Update existing cities whose country or coordinates changed'
+        )
+        parser.add_argument('--chunk-size', type=int, default=self.chunk_size, help='Number of rows written per query')
+        parser.add_argument('--url', default=self.url, help='URL of the city list (.xlsx, .csv, .json, optionally .gz)')
+        parser.add_argument('--force', action='store_true', help='Import the file even if it has not changed')
+
+    async def load_cities(self, loader: CityLoader) -> dict[str, int]:
+        started_at = time.monotonic()
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        total = 0
+        seen: set[str] = set()
+        async for chunk in loader.get_city_chunks(self.chunk_size):
+            # the first row wins when a name appears more than once in the file
+            rows: dict[str, CityData] = {}
+            for city in chunk:
+                if (name := city.name.lower()) not in seen:
+                    seen.add(name)
+                    rows[name] = city
+            stored = {
+                name: row_fingerprint(country, latitude, longitude)
+                async for name, country, latitude, longitude in City.objects.filter(
+                    name__in=rows
+                ).values_list('name', 'country', 'latitude', 'longitude')
+            }
+
+            changed = []
+            for name, city in rows.items():
+                fingerprint = row_fingerprint(city.country, city.lat, city.lon)
+                if name not in stored:
+                    counts['inserted'] += 1
+                elif stored[name] == fingerprint:
+                    counts['unchanged'] += 1
+                    continue
+                elif loader.override:
+                    counts['updated'] += 1
+                else:
+                    counts['skipped'] += 1
+                    continue
+                country, latitude, longitude = fingerprint
+                changed.append(City(name=name, country=country, latitude=latitude, longitude=longitude))
+
+            if changed:
+                await City.objects.abulk_create(
+                    changed,
+                    update_conflicts=True,
+                    unique_fields=['name'],
+                    # last_update moves too, so the coordinate index of the API picks the change up
+                    update_fields=['country', 'latitude', 'longitude', 'last_update'],
                 )
+            total += len(chunk)
+            elapsed = time.monotonic() - started_at
+            self.stdout.write(
+                f'{total} rows processed, {counts["inserted"]} inserted, {counts["updated"]} updated '
+                f'({total / elapsed:.0f} rows/s)'
+            )
+        if counts['inserted'] or counts['updated']:
+            await abump_city_names_version()
+        return counts
 
     def handle(self, *args, **options):
-        self.override = options['override']
-        asyncio.run(self.load_cities())
-        self.stdout.write(self.style.SUCCESS('Successfully populated the database with cities'))
+        self.chunk_size = options['chunk_size']
+        loader = CityLoader(options['url'], override=options['override'], force=options['force'])
+        counts = asyncio.run(self.load_cities(loader))
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully populated the database with cities: '
+            f'{counts["inserted"]} inserted, {counts["updated"]} updated, {counts["unchanged"]} unchanged'
+            + (f', {counts["skipped"]} changed but skipped (use --override)' if counts['skipped'] else '')
+        ))
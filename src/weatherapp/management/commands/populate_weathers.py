@@ -1,15 +1,86 @@
 import asyncio
+import socket
+from typing import Optional
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from openweather.client import OpenWeatherAPIClient
+from weatherapp import metrics
+from loader.scheduler import RefreshScheduler
+from loader.sharding import Shard, arefresh_shards, atry_claim
 from loader.weather_loader import WeatherLoader
 
 
 class Command(BaseCommand):
     help = 'Populate the weather table by calling the OpenWeather API'
-    wc = OpenWeatherAPIClient(api_key=settings.OPEN_WEATHER_API_KEY)
-    wl = WeatherLoader(client=wc)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--schedule', action='store_true',
+            help='Run as a daemon that only refreshes cities whose weather data is due'
+        )
+        shards = parser.add_mutually_exclusive_group()
+        shards.add_argument(
+            '--shard', metavar='INDEX/COUNT',
+            help='Only refresh the cities of one shard, e.g. 0/4 for the first of 4 workers'
+        )
+        shards.add_argument(
+            '--shards', type=int, metavar='COUNT',
+            help='Refresh every shard of COUNT that no other worker claimed, including those of crashed workers'
+        )
+
+    async def populate(self, schedule: bool = False, shards: Optional[list[Shard]] = None) -> None:
+        client = OpenWeatherAPIClient(
+            api_key=settings.OPEN_WEATHER_API_KEY,
+            connection_limit=settings.OPEN_WEATHER_CONNECTION_LIMIT,
+            connect_timeout=settings.OPEN_WEATHER_CONNECT_TIMEOUT,
+            read_timeout=settings.OPEN_WEATHER_READ_TIMEOUT,
+        )
+        async with client:
+            loader = WeatherLoader(
+                client=client,
+                calls_per_minute=settings.OPEN_WEATHER_CALLS_PER_MINUTE,
+                max_workers=settings.OPEN_WEATHER_MAX_WORKERS,
+                metrics_interval=settings.METRICS_PUBLISH_INTERVAL,
+            )
+            if shards and not schedule:
+                await arefresh_shards(loader, shards, claim_timeout=settings.WEATHER_SHARD_CLAIM_TIMEOUT_IN_MIN * 60)
+                return
+            if not schedule:
+                await loader.run()
+                return
+            shard = shards[0] if shards else None
+            lock = None
+            if shard is not None:
+                if (lock := await atry_claim(shard)) is None:
+                    # the daemon keeps its shard until it stops, so a second one for the same shard is a mistake
+                    raise CommandError(f'Shard {shard} is claimed by another worker')
+                # a daemon that lost its lock stops rather than write over another worker's shard
+                loader.before_write = lock.acheck
+            scheduler = RefreshScheduler.from_settings(loader, shard=shard)
+            try:
+                await scheduler.run_forever()
+            finally:
+                if lock is not None:
+                    await lock.arelease()
 
     def handle(self, *args, **options):
-        asyncio.run(self.wl.run())
+        shards = None
+        # every run of the command replaces the metrics of the previous one rather than adding to them
+        metrics.process_name = 'weather-loader'
+        if options['shard']:
+            try:
+                shards = [Shard.parse(options['shard'])]
+            except ValueError as exc:
+                raise CommandError(exc)
+            metrics.process_name = f'weather-loader:{shards[0]}'
+        elif options['shards'] is not None:
+            if options['schedule']:
+                raise CommandError('--schedule refreshes a single shard, use --shard INDEX/COUNT')
+            try:
+                shards = Shard.all(options['shards'])
+            except ValueError as exc:
+                raise CommandError(exc)
+            # the shards of such a worker change from run to run, so its metrics are kept per host
+            metrics.process_name = f'weather-loader:{socket.gethostname()}'
+        asyncio.run(self.populate(schedule=options['schedule'], shards=shards))
         self.stdout.write(self.style.SUCCESS('Successfully populated the weather table'))
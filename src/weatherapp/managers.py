@@ -1,16 +1,176 @@
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+from django.apps import apps
+from django.db import models, connections, transaction
+from django.db.models.functions import Trunc
+from django.utils import timezone
 from asgiref.sync import sync_to_async
 
+HISTORY_FIELDS = (
+    'temperature', 'min_temperature', 'max_temperature', 'humidity', 'pressure', 'wind_speed', 'wind_degree',
+)
+HISTORY_INTERVALS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+# the columns of a LatestWeather row read to build a weather response
+RESPONSE_FIELDS = ('city__name', *HISTORY_FIELDS, 'timestamp')
+
+
+def rollup_aggregates() -> dict:
+    """Aggregates of a bucket of WeatherData rows, named after the WeatherAggregate fields."""
+    return {
+        'samples': models.Count('id'),
+        # averages of scaled columns come back unscaled, minimums and maximums do not
+        'avg_temperature': models.Avg('temperature') / 100,
+        'min_temperature': models.Min('min_temperature'),
+        'max_temperature': models.Max('max_temperature'),
+        'avg_humidity': models.Avg('humidity'),
+        'avg_pressure': models.Avg('pressure'),
+        'avg_wind_speed': models.Avg('wind_speed') / 100,
+        'max_wind_speed': models.Max('wind_speed'),
+    }
 
-class WeatherDataManager(models.Manager):
-    def get_latest(self, city):
-        return self.filter(city=city).latest('timestamp')
 
+def _history_row(row: dict) -> dict:
+    """Name the bucket of a row 'timestamp' and turn scaled measurements into plain numbers."""
+    history_row = {'timestamp': row.pop('bucket') if 'bucket' in row else row.pop('timestamp')}
+    for key, value in row.items():
+        history_row[key] = float(value) if isinstance(value, Decimal) else value
+    return history_row
+
+
+class WeatherDataManager(models.Manager):
     def all_by_city(self, city):
-        return self.filter(city=city).order_by('-timestamp')
+        return self.filter(city__name=city).order_by('-timestamp')
+
+    async def aall_by_city(self, city):
+        """Return the history of a city, newest first."""
+        return [weather_data async for weather_data in self.all_by_city(city)]
+
+    async def ahistory(self, city, interval, start, end, after=None, limit=None, after_id=None):
+        """Yield the weather of a city in ``[start, end)``, oldest first, as raw rows or hour/day buckets.
+
+        Buckets are aggregated in SQL, except those of months whose raw rows were
+        already rolled up into WeatherAggregate and dropped. Only rows after
+        ``after`` are yielded, for keyset pagination, and at most ``limit`` of them.
+        Raw rows are ordered by timestamp and ID, and ``after_id`` is the ID of the
+        last row of the previous page, since several rows may share a timestamp.
+        """
+        history = self.filter(city=city, timestamp__gte=start, timestamp__lt=end)
+        if interval == 'raw':
+            if after is not None:
+                after_row = models.Q(timestamp__gt=after)
+                if after_id is not None:
+                    after_row |= models.Q(timestamp=after, id__gt=after_id)
+                history = history.filter(after_row)
+            querysets = [history.order_by('timestamp', 'id').values('timestamp', 'id', *HISTORY_FIELDS)]
+        else:
+            if after is not None:
+                start = max(start, after + HISTORY_INTERVALS[interval])
+                history = history.filter(timestamp__gte=start)
+            # roll-ups only cover the buckets before the oldest raw row
+            first = await history.order_by('timestamp').values_list('timestamp', flat=True).afirst()
+            split = end if first is None else timezone.localtime(first).replace(
+                minute=0, second=0, microsecond=0, **({'hour': 0} if interval == 'day' else {})
+            )
+            WeatherAggregate = apps.get_model('weatherapp', 'WeatherAggregate')
+            rollups = WeatherAggregate.objects.using(self.db).filter(
+                city=city.name, period=interval, bucket__gte=start, bucket__lt=split
+            )
+            querysets = [
+                rollups.order_by('bucket').values('bucket', *rollup_aggregates()),
+                history.annotate(bucket=Trunc('timestamp', interval)).values('bucket')
+                .annotate(**rollup_aggregates()).order_by('bucket'),
+            ]
+
+        for queryset in querysets:
+            if limit is not None:
+                if limit <= 0:
+                    return
+                queryset = queryset[:limit]
+            async for row in queryset.aiterator(chunk_size=2000):
+                if limit is not None:
+                    limit -= 1
+                yield _history_row(row)
+
+    def bulk_insert(self, objs):
+        """Insert many rows at once and refresh the LatestWeather rows of their cities in the same transaction."""
+        with transaction.atomic(using=self.db):
+            objs = self._bulk_insert(objs)
+            apps.get_model('weatherapp', 'LatestWeather').objects.db_manager(self.db).upsert(objs)
+        return objs
+
+    def _bulk_insert(self, objs):
+        """Insert rows with COPY on PostgreSQL and bulk_create elsewhere."""
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            return self.bulk_create(objs)
+
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            with cursor.copy(f'COPY {table} ({columns}) FROM STDIN') as copy:
+                for obj in objs:
+                    copy.write_row([field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields])
+        return objs
+
+    async def abulk_insert(self, objs):
+        return await sync_to_async(self.bulk_insert)(objs)
+
+
+class LatestWeatherManager(models.Manager):
+    def _latest(self):
+        return self.select_related('city').only(*RESPONSE_FIELDS)
+
+    def get_latest(self, city):
+        """Return the current weather of a city, by name, with only the columns of its response."""
+        return self._latest().get(city__name=city)
 
     async def aget_latest(self, city):
-        return await sync_to_async(self.get_latest)(city=city)
+        return await self._latest().aget(city__name=city)
 
-    async def aall_by_city(self, city):
-        return await sync_to_async(self.all_by_city)(city=city)
+    async def aget_latest_many(self, cities):
+        """Return the current weather of many cities, keyed by name, with a single query."""
+        return {weather.city.name: weather async for weather in self._latest().filter(city__name__in=cities)}
+
+    def upsert(self, observations):
+        """Make the given WeatherData rows the latest observation of their cities."""
+        # the last observation wins when a city appears more than once
+        latest = {obs.city_id: self.model.from_weather_data(obs) for obs in observations}
+        return self.bulk_create(
+            latest.values(),
+            update_conflicts=True,
+            unique_fields=['city'],
+            update_fields=list(self.model.OBSERVATION_FIELDS),
+        )
+
+
+class WeatherAggregateManager(models.Manager):
+    def downsample(self, period, start, end, batch_size=2000):
+        """Roll the WeatherData rows in ``[start, end)`` up into ``period`` buckets, replacing earlier roll-ups."""
+        WeatherData = apps.get_model('weatherapp', 'WeatherData')
+        rows = (
+            WeatherData.objects.using(self.db)
+            .filter(timestamp__gte=start, timestamp__lt=end)
+            .annotate(bucket=Trunc('timestamp', period), city_name=models.F('city__name'))
+            .values('city_name', 'bucket')
+            .annotate(**rollup_aggregates())
+            .order_by()
+        )
+        batch, total = [], 0
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(self.model(period=period, city=row.pop('city_name'), **row))
+            if len(batch) == batch_size:
+                total += len(self._upsert(batch))
+                batch = []
+        return total + len(self._upsert(batch))
+
+    def _upsert(self, aggregates):
+        return self.bulk_create(
+            aggregates,
+            update_conflicts=True,
+            unique_fields=['city', 'period', 'bucket'],
+            update_fields=[
+                'samples', 'avg_temperature', 'min_temperature', 'max_temperature',
+                'avg_humidity', 'avg_pressure', 'avg_wind_speed', 'max_wind_speed',
+            ],
+        )
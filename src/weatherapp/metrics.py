@@ -0,0 +1,221 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Iterator, Optional
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import Metric
+
+METRICS_KEY = 'metrics:{}'
+METRICS_PROCESSES_KEY = 'metrics-processes'  # a Redis set of the keys of the processes that published metrics
+METRICS_TIMEOUT = 24 * 60 * 60  # metrics of a process that stopped publishing are dropped after a day
+PRUNE_INTERVAL = 60 * 60  # seconds between two removals of the processes whose metrics expired
+
+# metrics of this process, apart from the default registry whose process and platform metrics do not add up
+registry = CollectorRegistry()
+# how the values of a gauge in several processes are combined, added up unless 'max' is listed here
+gauge_aggregates: dict[str, str] = {}
+
+# a snapshot holds the (name, type, documentation, samples) of every metric, and a sample (name, labels, value)
+Snapshot = list[tuple[str, str, str, list[tuple[str, dict[str, str], float]]]]
+
+
+def gauge(name: str, documentation: str, labelnames: tuple[str, ...] = (), aggregate: str = 'sum') -> Gauge:
+    """A gauge of this process, whose values in several processes are combined by ``aggregate``, 'sum' or 'max'."""
+    gauge_aggregates[name] = aggregate
+    return Gauge(name, documentation, labelnames, registry=registry)
+
+
+def snapshot() -> Snapshot:
+    """The samples of every metric of this process."""
+    return [
+        (family.name, family.type, family.documentation, [
+            (sample.name, sample.labels, sample.value)
+            for sample in family.samples if not sample.name.endswith('_created')  # differs in every process
+        ])
+        for family in registry.collect()
+    ]
+
+
+class MergedCollector:
+    """
+    Collector of the metrics of several processes, from their snapshots.
+    attributes:
+        snapshots (list[Snapshot]): The snapshot of every process.
+    """
+
+    def __init__(self, snapshots: list[Snapshot]) -> None:
+        self.snapshots = snapshots
+
+    def collect(self) -> Iterator[Metric]:
+        families: dict[str, tuple[Metric, dict[tuple, float]]] = {}
+        for process_snapshot in self.snapshots:
+            for name, metric_type, documentation, samples in process_snapshot:
+                family, values = families.setdefault(name, (Metric(name, documentation, metric_type), {}))
+                use_max = metric_type == 'gauge' and gauge_aggregates.get(name) == 'max'
+                for sample_name, labels, value in samples:
+                    key = (sample_name, tuple(sorted(labels.items())))
+                    if key not in values:
+                        values[key] = value
+                    else:
+                        values[key] = max(values[key], value) if use_max else values[key] + value
+        for family, values in families.values():
+            for (sample_name, labels), value in values.items():
+                family.add_sample(sample_name, dict(labels), value)
+            yield family
+
+
+def render(snapshots: list[Snapshot]) -> str:
+    """Merge the snapshots of several processes into the Prometheus text format."""
+    merged = CollectorRegistry(auto_describe=False)
+    merged.register(MergedCollector(snapshots))
+    return generate_latest(merged).decode()
+
+
+_redis_client: Optional[redis.Redis] = None
+
+
+def _redis() -> Optional[redis.Redis]:
+    """A client of the Redis server of the shared cache, None when the cache is another backend, as in tests.
+
+    The cache API has no set commands, so the process registry is kept through a
+    client of its own, on the server the cache writes to.
+    """
+    global _redis_client
+    if not isinstance(caches['default'], RedisCache):
+        return None
+    if _redis_client is None:
+        location = settings.CACHES['default']['LOCATION']
+        # as in RedisCache, the first of several servers is the one written to
+        servers = location.split(',') if isinstance(location, str) else location
+        _redis_client = redis.Redis.from_url(servers[0])
+    return _redis_client
+
+
+def _processes_key() -> str:
+    return cache.make_and_validate_key(METRICS_PROCESSES_KEY)
+
+
+def _add_process(key: str) -> None:
+    if (client := _redis()) is not None:
+        client.sadd(_processes_key(), key)
+        return
+    # not atomic, but the other backends used here are local to the process
+    cache.set(METRICS_PROCESSES_KEY, (cache.get(METRICS_PROCESSES_KEY) or set()) | {key}, timeout=None)
+
+
+def _remove_processes(keys: set[str]) -> None:
+    if (client := _redis()) is not None:
+        client.srem(_processes_key(), *keys)
+        return
+    cache.set(METRICS_PROCESSES_KEY, (cache.get(METRICS_PROCESSES_KEY) or set()) - keys, timeout=None)
+
+
+def _get_processes() -> set[str]:
+    if (client := _redis()) is not None:
+        return {member.decode() for member in client.smembers(_processes_key())}
+    return cache.get(METRICS_PROCESSES_KEY) or set()
+
+
+# name the metrics of this process are published under, its host and PID by default
+process_name: Optional[str] = None
+_published_at: Optional[float] = None
+_pruned_at: Optional[float] = None
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _process_key() -> str:
+    return METRICS_KEY.format(process_name or f'{socket.gethostname()}:{os.getpid()}')
+
+
+async def apublish() -> None:
+    """Store the metrics of this process in the shared cache, where the /metrics endpoint collects them.
+
+    The API and the loader run in separate processes, so each one publishes its
+    own cumulative values and the endpoint adds them up. A loader started anew for
+    every run publishes under a fixed ``process_name``, so it replaces the metrics
+    of the previous run instead of adding to them.
+    """
+    global _published_at, _pruned_at
+    _published_at = time.monotonic()
+    key = _process_key()
+    await cache.aset(key, snapshot(), timeout=METRICS_TIMEOUT)
+    await sync_to_async(_add_process)(key)
+    if _pruned_at is None or _published_at - _pruned_at >= PRUNE_INTERVAL:
+        _pruned_at = _published_at
+        processes = await sync_to_async(_get_processes)()
+        if expired := processes - (await cache.aget_many(list(processes))).keys():
+            await sync_to_async(_remove_processes)(expired)
+
+
+def publish_if_due() -> None:
+    """Publish in the background when the last publish is older than ``METRICS_PUBLISH_INTERVAL``."""
+    global _published_at
+    if _published_at is not None and time.monotonic() - _published_at < settings.METRICS_PUBLISH_INTERVAL:
+        return
+    _published_at = time.monotonic()
+    task = asyncio.create_task(apublish())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def acollect() -> str:
+    """The metrics of this process and of every other one that published them, in the Prometheus text format.
+
+    Only reads the shared cache, so scrapes do not write to it.
+    """
+    processes = await sync_to_async(_get_processes)() - {_process_key()}
+    published = await cache.aget_many(list(processes))
+    # snapshots of other versions of the code are left out
+    return render([snapshot(), *(value for value in published.values() if isinstance(value, list))])
+
+
+# weather loader
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    'weather_loader_upstream_request_seconds', 'Duration of the requests to the OpenWeather API.', ('outcome',),
+    registry=registry,
+)
+DB_WRITE_SECONDS = Histogram(
+    'weather_loader_db_write_seconds', 'Duration of the writes of a batch of reports.', registry=registry
+)
+QUEUE_DEPTH = gauge('weather_loader_queue_depth', 'Number of items waiting in a loader queue.', ('queue',))
+THROTTLED = Counter(
+    'weather_loader_throttled_total', 'Requests answered with 429 Too Many Requests.', registry=registry
+)
+CIRCUIT_BREAKER_STATE = gauge(
+    'weather_loader_circuit_breaker_state', 'Circuit breaker state: 0 closed, 1 half-open, 2 open.', aggregate='max'
+)
+CIRCUIT_BREAKER_TRIPS = Counter(
+    'weather_loader_circuit_breaker_trips_total', 'Times the circuit breaker opened, by failure policy.', ('policy',),
+    registry=registry,
+)
+CITIES_RETRIED = Counter(
+    'weather_loader_cities_retried_total', 'Cities queued again after a failed request.', registry=registry
+)
+CITIES_FAILED = Counter(
+    'weather_loader_cities_failed_total', 'Cities still failing when a run gave up on them.', registry=registry
+)
+RUNS = Counter('weather_loader_runs_total', 'Completed loader runs.', registry=registry)
+CITIES_WRITTEN = Counter(
+    'weather_loader_cities_written_total', 'Weather reports written to the database.', registry=registry
+)
+LAST_RUN_SECONDS = gauge('weather_loader_last_run_seconds', 'Duration of the last loader run.', aggregate='max')
+LAST_RUN_CITIES = gauge('weather_loader_last_run_cities_written', 'Weather reports written by the last loader run.')
+LAST_RUN_TIMESTAMP = gauge(
+    'weather_loader_last_run_timestamp_seconds', 'Unix time the last loader run finished at.', aggregate='max'
+)
+
+# weather API
+CACHE_LOOKUPS = Counter(
+    'weather_cache_lookups_total', 'Weather response lookups by the tier that answered them.', ('result',),
+    registry=registry,
+)
+API_REQUEST_SECONDS = Histogram(
+    'weather_api_request_seconds', 'Duration of the weather API requests.', ('view', 'method', 'status'),
+    registry=registry,
+)
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('country', models.CharField(max_length=100)),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('openweather_id', models.PositiveIntegerField(blank=True, db_index=True, null=True)),
+                ('active', models.BooleanField(default=False)),
+                ('last_update', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
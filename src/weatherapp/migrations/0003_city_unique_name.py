@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0002_city'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='city',
+            constraint=models.UniqueConstraint(fields=('name',), name='unique_city_name'),
+        ),
+    ]
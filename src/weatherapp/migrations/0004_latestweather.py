@@ -0,0 +1,57 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:07
+
+from django.db import migrations, models
+
+OBSERVATION_FIELDS = (
+    'temperature', 'min_temperature', 'max_temperature', 'humidity',
+    'pressure', 'wind_speed', 'wind_degree', 'wind_direction', 'timestamp',
+)
+
+
+def backfill_latest_weather(apps, schema_editor):
+    WeatherData = apps.get_model('weatherapp', 'WeatherData')
+    LatestWeather = apps.get_model('weatherapp', 'LatestWeather')
+    db = schema_editor.connection.alias
+
+    batch, last_city = [], None
+    for weather_data in WeatherData.objects.using(db).order_by('city', '-timestamp').iterator(chunk_size=2000):
+        if weather_data.city == last_city:
+            continue
+        last_city = weather_data.city
+        batch.append(LatestWeather(
+            city=weather_data.city,
+            **{field: getattr(weather_data, field) for field in OBSERVATION_FIELDS}
+        ))
+        if len(batch) == 2000:
+            LatestWeather.objects.using(db).bulk_create(batch)
+            batch = []
+    LatestWeather.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0003_city_unique_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestWeather',
+            fields=[
+                ('temperature', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('min_temperature', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('max_temperature', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('humidity', models.PositiveIntegerField()),
+                ('pressure', models.IntegerField()),
+                ('wind_speed', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('wind_degree', models.IntegerField()),
+                ('wind_direction', models.CharField(max_length=20, null=True)),
+                ('city', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(backfill_latest_weather, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0004_latestweather'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=100)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField()),
+                ('avg_temperature', models.FloatField()),
+                ('min_temperature', models.FloatField()),
+                ('max_temperature', models.FloatField()),
+                ('avg_humidity', models.FloatField()),
+                ('avg_pressure', models.FloatField()),
+                ('avg_wind_speed', models.FloatField()),
+                ('max_wind_speed', models.FloatField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('city', 'period', 'bucket'), name='unique_weather_aggregate')],
+            },
+        ),
+    ]
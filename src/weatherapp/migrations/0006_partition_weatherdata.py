@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# Django keeps treating the table as a regular one; only its storage changes.
+# The primary key of a partitioned table has to include the partition key, and
+# identity columns need PostgreSQL 17 on partitioned tables, so a sequence is used.
+PARTITION_SQL = '''
+CREATE TABLE weatherapp_weatherdata_partitioned (
+    LIKE weatherapp_weatherdata INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+) PARTITION BY RANGE ("timestamp");
+CREATE SEQUENCE weatherapp_weatherdata_partitioned_id_seq OWNED BY weatherapp_weatherdata_partitioned.id;
+ALTER TABLE weatherapp_weatherdata_partitioned
+    ALTER COLUMN id SET DEFAULT nextval('weatherapp_weatherdata_partitioned_id_seq');
+ALTER TABLE weatherapp_weatherdata_partitioned ADD PRIMARY KEY (id, "timestamp");
+CREATE TABLE weatherapp_weatherdata_default PARTITION OF weatherapp_weatherdata_partitioned DEFAULT;
+INSERT INTO weatherapp_weatherdata_partitioned SELECT * FROM weatherapp_weatherdata;
+DROP TABLE weatherapp_weatherdata;
+ALTER TABLE weatherapp_weatherdata_partitioned RENAME TO weatherapp_weatherdata;
+ALTER SEQUENCE weatherapp_weatherdata_partitioned_id_seq RENAME TO weatherapp_weatherdata_id_seq;
+CREATE INDEX weatherapp__city_ef9104_idx ON weatherapp_weatherdata (city, "timestamp" DESC);
+SELECT setval(pg_get_serial_sequence('weatherapp_weatherdata', 'id'), COALESCE(MAX(id), 0) + 1, false)
+    FROM weatherapp_weatherdata;
+'''
+
+
+def partition_weather_data(apps, schema_editor):
+    """Turn WeatherData into a table range-partitioned by timestamp, on PostgreSQL only.
+
+    Rows start out in the default partition; `manage_weather_history` creates the
+    monthly partitions and moves matching rows out of it.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in PARTITION_SQL.split(';'):
+        if statement.strip():
+            schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0005_weatheraggregate'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_weather_data, migrations.RunPython.noop),
+    ]
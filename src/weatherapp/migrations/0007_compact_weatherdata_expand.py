@@ -0,0 +1,59 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+import weatherapp.fields
+
+# Expand phase of the compact WeatherData schema: the old columns are renamed
+# and the compact ones added next to them as nullable, which needs no table
+# rewrite. Rows are copied over by `backfill_compact_weather` (or migration 0008)
+# and the old columns are dropped in 0009.
+RENAMED_FIELDS = [
+    'temperature', 'min_temperature', 'max_temperature', 'humidity', 'pressure', 'wind_speed', 'wind_degree',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0006_partition_weatherdata'),
+    ]
+
+    operations = [
+        migrations.RenameField(model_name='weatherdata', old_name='city', new_name='city_name'),
+        *[
+            migrations.RenameField(model_name='weatherdata', old_name=name, new_name=f'{name}_legacy')
+            for name in RENAMED_FIELDS
+        ],
+        migrations.AddField(
+            model_name='weatherdata',
+            name='city',
+            field=models.ForeignKey(
+                db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                related_name='weather_data', to='weatherapp.city',
+            ),
+        ),
+        migrations.AddField(
+            model_name='weatherdata', name='temperature',
+            field=weatherapp.fields.ScaledIntegerField(small=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherdata', name='min_temperature',
+            field=weatherapp.fields.ScaledIntegerField(small=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherdata', name='max_temperature',
+            field=weatherapp.fields.ScaledIntegerField(small=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherdata', name='humidity', field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherdata', name='pressure', field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherdata', name='wind_speed', field=weatherapp.fields.ScaledIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherdata', name='wind_degree', field=models.SmallIntegerField(null=True),
+        ),
+    ]
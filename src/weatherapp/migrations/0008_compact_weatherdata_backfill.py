@@ -0,0 +1,21 @@
+from django.db import migrations
+
+from weatherapp.backfill import backfill_compact_weather, create_missing_cities
+
+
+def backfill(apps, schema_editor):
+    """Backfill whatever `backfill_compact_weather` has not copied yet."""
+    create_missing_cities(schema_editor.connection)
+    for _ in backfill_compact_weather(schema_editor.connection):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0007_compact_weatherdata_expand'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
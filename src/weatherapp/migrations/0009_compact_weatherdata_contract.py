@@ -0,0 +1,101 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+import weatherapp.fields
+
+OBSERVATION_FIELDS = (
+    'temperature', 'min_temperature', 'max_temperature', 'humidity',
+    'pressure', 'wind_speed', 'wind_degree', 'timestamp',
+)
+LEGACY_FIELDS = [
+    'city_name', 'temperature_legacy', 'min_temperature_legacy', 'max_temperature_legacy',
+    'humidity_legacy', 'pressure_legacy', 'wind_speed_legacy', 'wind_degree_legacy', 'wind_direction',
+]
+
+
+def rebuild_latest_weather(apps, schema_editor):
+    WeatherData = apps.get_model('weatherapp', 'WeatherData')
+    LatestWeather = apps.get_model('weatherapp', 'LatestWeather')
+    db = schema_editor.connection.alias
+
+    batch, last_city = [], None
+    for weather_data in WeatherData.objects.using(db).order_by('city_id', '-timestamp').iterator(chunk_size=2000):
+        if weather_data.city_id == last_city:
+            continue
+        last_city = weather_data.city_id
+        batch.append(LatestWeather(
+            city_id=weather_data.city_id,
+            **{field: getattr(weather_data, field) for field in OBSERVATION_FIELDS}
+        ))
+        if len(batch) == 2000:
+            LatestWeather.objects.using(db).bulk_create(batch)
+            batch = []
+    LatestWeather.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0008_compact_weatherdata_backfill'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(model_name='weatherdata', name='weatherapp__city_ef9104_idx'),
+        *[migrations.RemoveField(model_name='weatherdata', name=name) for name in LEGACY_FIELDS],
+        migrations.AlterField(
+            model_name='weatherdata',
+            name='city',
+            field=models.ForeignKey(
+                db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                related_name='weather_data', to='weatherapp.city',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata', name='temperature', field=weatherapp.fields.ScaledIntegerField(small=False),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata', name='min_temperature', field=weatherapp.fields.ScaledIntegerField(small=False),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata', name='max_temperature', field=weatherapp.fields.ScaledIntegerField(small=False),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata', name='humidity', field=models.PositiveSmallIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata', name='pressure', field=models.SmallIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata', name='wind_speed', field=weatherapp.fields.ScaledIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata', name='wind_degree', field=models.SmallIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='weatherdata',
+            index=models.Index(fields=['city', '-timestamp'], name='weatherapp__city_id_b311ec_idx'),
+        ),
+        # the projection is small enough to be rebuilt from the compact history
+        migrations.DeleteModel(name='LatestWeather'),
+        migrations.CreateModel(
+            name='LatestWeather',
+            fields=[
+                ('temperature', weatherapp.fields.ScaledIntegerField(small=False)),
+                ('min_temperature', weatherapp.fields.ScaledIntegerField(small=False)),
+                ('max_temperature', weatherapp.fields.ScaledIntegerField(small=False)),
+                ('humidity', models.PositiveSmallIntegerField()),
+                ('pressure', models.SmallIntegerField()),
+                ('wind_speed', weatherapp.fields.ScaledIntegerField()),
+                ('wind_degree', models.SmallIntegerField()),
+                ('city', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                    related_name='latest_weather', serialize=False, to='weatherapp.city',
+                )),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(rebuild_latest_weather, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_weather_updated_at(apps, schema_editor):
+    """Start from the time of the latest observation of each city, so the cities are not all due at once."""
+    City = apps.get_model('weatherapp', 'City')
+    LatestWeather = apps.get_model('weatherapp', 'LatestWeather')
+    City.objects.using(schema_editor.connection.alias).update(
+        weather_updated_at=Subquery(LatestWeather.objects.filter(city=OuterRef('pk')).values('timestamp')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0009_compact_weatherdata_contract'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='weather_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_weather_updated_at, migrations.RunPython.noop),
+    ]
@@ -1,37 +1,42 @@
 from typing import Any
-from django.db import models
-from openweather.items import WeatherReport
-from .managers import WeatherDataManager
+from django.db import models, transaction
+from openweather.items import MEASUREMENT_FIELDS, WeatherReport
+from .fields import ScaledIntegerField
+from .managers import LatestWeatherManager, WeatherAggregateManager, WeatherDataManager
 from django.utils.translation import gettext as _
 
 
-class WeatherData(models.Model):
-    city = models.CharField(max_length=100)
-    temperature = models.DecimalField(max_digits=5, decimal_places=2)
-    min_temperature = models.DecimalField(max_digits=5, decimal_places=2)
-    max_temperature = models.DecimalField(max_digits=5, decimal_places=2)
-    humidity = models.PositiveIntegerField()
-    pressure = models.IntegerField()
-    wind_speed = models.DecimalField(max_digits=5, decimal_places=2)
-    wind_degree = models.IntegerField()
-    wind_direction = models.CharField(max_length=20, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+class WeatherObservation(models.Model):
+    """Measurements shared by the weather history and the latest-weather projection.
 
-    objects = WeatherDataManager()
+    Measurements are stored as integers (temperatures and wind speed in
+    hundredths) and the wind direction is derived from ``wind_degree``.
+    Temperatures in Kelvin exceed the 327.67 of a small integer in hundredths,
+    so they are stored in four bytes.
+    """
+    temperature = ScaledIntegerField(small=False)
+    min_temperature = ScaledIntegerField(small=False)
+    max_temperature = ScaledIntegerField(small=False)
+    humidity = models.PositiveSmallIntegerField()
+    pressure = models.SmallIntegerField()
+    wind_speed = ScaledIntegerField()
+    wind_degree = models.SmallIntegerField()
+
+    # fields copied from a WeatherData row into its LatestWeather row
+    OBSERVATION_FIELDS = (
+        'temperature', 'min_temperature', 'max_temperature', 'humidity',
+        'pressure', 'wind_speed', 'wind_degree', 'timestamp',
+    )
 
     class Meta:
-        indexes = [
-            models.Index(fields=['city', '-timestamp'])
-        ]
+        abstract = True
 
     def __str__(self):
         return f'{self.city} - {self.temperature}'
 
-    @classmethod
-    def from_weather_report(cls, weather_report: WeatherReport):
-        return cls(
-            **vars(weather_report)
-        )
+    @property
+    def wind_direction(self) -> str:
+        return self.get_wind_cardinal_direction()
 
     def get_wind_cardinal_direction(self) -> str:
         """Get cardinal direction based on degrees."""
@@ -48,14 +53,10 @@ class WeatherData(models.Model):
                 return direction
         return 'Unknown'
 
-    def save(self, *args, **kwargs):
-        self.wind_direction = self.get_wind_cardinal_direction()
-        super().save(*args, **kwargs)
-
     def to_dict(self) -> dict[str, Any]:
-        """Serialize WeatherData object to a dictionary."""
+        """Serialize the observation to a dictionary."""
         return {
-            'city': self.city,
+            'city': self.city.name,
             'temperature': {
                 'current': self.temperature,
                 'minimum': self.min_temperature,
@@ -70,13 +71,87 @@ class WeatherData(models.Model):
         }
 
 
+class WeatherData(WeatherObservation):
+    # indexed together with timestamp below
+    city = models.ForeignKey('City', on_delete=models.CASCADE, related_name='weather_data', db_index=False)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = WeatherDataManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', '-timestamp'])
+        ]
+
+    @classmethod
+    def from_weather_report(cls, weather_report: WeatherReport, city: 'City'):
+        return cls(city=city, **{field: getattr(weather_report, field) for field in MEASUREMENT_FIELDS})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            LatestWeather.objects.db_manager(kwargs.get('using')).upsert([self])
+
+
+class LatestWeather(WeatherObservation):
+    """The most recent WeatherData of each city, kept up to date on every insert."""
+    city = models.OneToOneField('City', on_delete=models.CASCADE, primary_key=True, related_name='latest_weather')
+    timestamp = models.DateTimeField()
+
+    objects = LatestWeatherManager()
+
+    @classmethod
+    def from_weather_data(cls, weather_data: WeatherData):
+        return cls(
+            city_id=weather_data.city_id,
+            **{field: getattr(weather_data, field) for field in cls.OBSERVATION_FIELDS}
+        )
+
+
+class WeatherAggregate(models.Model):
+    """Hourly or daily roll-up of WeatherData, kept after the raw rows are dropped."""
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    city = models.CharField(max_length=100)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    samples = models.PositiveIntegerField()
+    avg_temperature = models.FloatField()
+    min_temperature = models.FloatField()
+    max_temperature = models.FloatField()
+    avg_humidity = models.FloatField()
+    avg_pressure = models.FloatField()
+    avg_wind_speed = models.FloatField()
+    max_wind_speed = models.FloatField()
+
+    objects = WeatherAggregateManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'period', 'bucket'], name='unique_weather_aggregate')
+        ]
+
+    def __str__(self):
+        return f'{self.city} - {self.period} {self.bucket}'
+
+
 class City(models.Model):
     name = models.CharField(max_length=100)
     country = models.CharField(max_length=100)
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    openweather_id = models.PositiveIntegerField(null=True, blank=True, db_index=True)
     active = models.BooleanField(default=False)
     last_update = models.DateTimeField(auto_now=True)
+    # when the loader last wrote weather data for the city, apart from last_update that tracks edits of the city
+    weather_updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='unique_city_name')
+        ]
 
     def __str__(self):
         return f'{self.name} - {self.country}'
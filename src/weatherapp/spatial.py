@@ -0,0 +1,161 @@
+import math
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import City
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class IndexedCity(NamedTuple):
+    pk: int
+    name: str
+    latitude: float
+    longitude: float
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points, in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class CityGrid:
+    """
+    Cities bucketed into cells of ``cell_size`` degrees, so radius and nearest-city
+    queries only visit the cells that can hold a match.
+    attributes:
+        cell_size (float): The size of a cell in degrees of latitude and longitude.
+        columns (int): The number of cells around a parallel.
+    """
+
+    def __init__(self, cell_size: float = 1.0) -> None:
+        self.cell_size = cell_size
+        self.columns = math.ceil(360 / cell_size)
+        self._cells: dict[tuple[int, int], dict[int, IndexedCity]] = {}
+        self._cities: dict[int, IndexedCity] = {}
+
+    def __len__(self) -> int:
+        return len(self._cities)
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return math.floor(latitude / self.cell_size), math.floor((longitude + 180) / self.cell_size) % self.columns
+
+    def add(self, city: IndexedCity) -> None:
+        self.remove(city.pk)
+        self._cities[city.pk] = city
+        self._cells.setdefault(self._cell(city.latitude, city.longitude), {})[city.pk] = city
+
+    def remove(self, pk: int) -> None:
+        if (city := self._cities.pop(pk, None)) is None:
+            return
+        cell = self._cell(city.latitude, city.longitude)
+        del self._cells[cell][pk]
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def clear(self) -> None:
+        self._cells.clear()
+        self._cities.clear()
+
+    def within(self, latitude: float, longitude: float, radius: float) -> list[tuple[float, IndexedCity]]:
+        """Return ``(distance, city)`` for every city within ``radius`` kilometres, nearest first."""
+        angle = radius / EARTH_RADIUS_KM
+        delta = math.degrees(angle)
+        if latitude + delta >= 90 or latitude - delta <= -90:
+            # the circle contains a pole, so it spans every meridian
+            columns = range(self.columns)
+        else:
+            delta_lon = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+            first = math.floor((longitude - delta_lon + 180) / self.cell_size)
+            last = math.floor((longitude + delta_lon + 180) / self.cell_size)
+            columns = range(self.columns) if last - first >= self.columns else [
+                column % self.columns for column in range(first, last + 1)
+            ]
+        rows = range(
+            math.floor(max(latitude - delta, -90) / self.cell_size),
+            math.floor(min(latitude + delta, 90) / self.cell_size) + 1,
+        )
+
+        matches = []
+        for row in rows:
+            for column in columns:
+                for city in self._cells.get((row, column), {}).values():
+                    if (distance := haversine(latitude, longitude, city.latitude, city.longitude)) <= radius:
+                        matches.append((distance, city))
+        matches.sort()
+        return matches
+
+    def nearest(self, latitude: float, longitude: float) -> Optional[tuple[float, IndexedCity]]:
+        """Return ``(distance, city)`` of the nearest city, widening the search radius until one is found."""
+        if not self._cities:
+            return None
+        radius = self.cell_size * math.pi * EARTH_RADIUS_KM / 180
+        while not (matches := self.within(latitude, longitude, radius)):
+            radius *= 4
+        return matches[0]
+
+
+class CityIndex:
+    """
+    Grid of the active cities of this process. It is loaded on server startup, or
+    else on first use, and then refreshed incrementally with the cities whose
+    ``last_update`` moved.
+    attributes:
+        refresh_interval (float): Seconds between two incremental refreshes.
+        grid (CityGrid): The indexed cities.
+    """
+
+    def __init__(self, refresh_interval: float) -> None:
+        self.refresh_interval = refresh_interval
+        self.grid = CityGrid()
+        self._synced_at: Optional[datetime] = None
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Index the cities created or changed since the last refresh and drop the deactivated ones."""
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.refresh_interval:
+                return
+            if self._synced_at is None:
+                cities = City.objects.filter(active=True)
+            else:
+                # rows written during the last refresh are read again rather than missed
+                cities = City.objects.filter(last_update__gte=self._synced_at)
+
+            rows = cities.values_list('pk', 'name', 'latitude', 'longitude', 'active', 'last_update')
+            for pk, name, latitude, longitude, active, last_update in rows.iterator(chunk_size=5000):
+                if active:
+                    self.grid.add(IndexedCity(pk, name, float(latitude), float(longitude)))
+                else:
+                    self.grid.remove(pk)
+                if self._synced_at is None or last_update > self._synced_at:
+                    self._synced_at = last_update
+            self._checked_at = time.monotonic()
+
+    async def arefresh(self) -> None:
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.refresh_interval:
+            await sync_to_async(self.refresh)()
+
+    def clear(self) -> None:
+        """Forget every city, so the next refresh loads them all again."""
+        with self._lock:
+            self.grid.clear()
+            self._synced_at = self._checked_at = None
+
+    async def anearest(self, latitude: float, longitude: float) -> Optional[tuple[float, IndexedCity]]:
+        await self.arefresh()
+        return self.grid.nearest(latitude, longitude)
+
+    async def awithin(self, latitude: float, longitude: float, radius: float) -> list[tuple[float, IndexedCity]]:
+        await self.arefresh()
+        return self.grid.within(latitude, longitude, radius)
+
+
+city_index = CityIndex(refresh_interval=settings.WEATHER_CITY_INDEX_REFRESH_INTERVAL)
@@ -1,8 +1,52 @@
+import asyncio
+import gzip
+import hashlib
+import json
 import logging
-from django.test import TestCase
+import socket
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
+from aiohttp import ClientPayloadError, web
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
 from django.core.cache import cache
-from .models import WeatherData
+from django.db import connection, connections
+from django.utils import timezone
+from django.utils.cache import get_max_age
+from django.utils.http import http_date, parse_http_date_safe
+from benchmarks.fake_openweather import FakeOpenWeather
+from loader.circuit_breaker import CircuitBreaker, FailurePolicy
+from loader.city_loader import CityData, CityLoader
+from loader.rate_limiter import AdaptiveConcurrency, TokenBucket
+from loader.scheduler import RefreshScheduler
+from loader.sharding import SHARD_LOCK_NAMESPACE, Shard, arefresh_shards, atry_claim
+from loader.weather_loader import WeatherLoader
+from openweather.client import OpenWeatherAPIClient, json_loads
+from openweather.exceptions import UnauthorizedError, UnexpectedError
+from openweather.items import WeatherReport, WeatherReportBatch
+from weather_wise.asgi import application
+from . import metrics
+from .autocomplete import city_names
+from .cache import (
+    ainvalidate_weather,
+    aget_city_hits,
+    arecord_city_hit,
+    city_hits_key,
+    local_cache,
+    weather_cache_keys,
+    weather_modified_key,
+)
+from .management.commands.manage_weather_history import Command as ManageWeatherHistory, add_months, month_start
+from .management.commands.populate_contries import Command as PopulateCountries
+from .models import City, LatestWeather, WeatherAggregate, WeatherData
+from .spatial import city_index
 
 
 SUCCESS_RESPONSE = {
@@ -15,16 +59,22 @@ SUCCESS_RESPONSE = {
 }
 
 
+def metric_value(name, **labels):
+    return metrics.registry.get_sample_value(name, {key: str(value) for key, value in labels.items()}) or 0.0
+
+
 class WeatherApiViewTest(TestCase):
     def setUp(self) -> None:
         self.url = reverse('weather-api')
         WeatherData.objects.create(
-            city='TestCity1'.lower(), temperature=298.48, min_temperature=297.56, max_temperature=300.05,
-            humidity=64, pressure=1015, wind_speed=0.62, wind_degree=0, wind_direction='North'
+            city=City.objects.create(name='TestCity1'.lower(), country='XX', latitude=10, longitude=179.5, active=True),
+            temperature=298.48, min_temperature=297.56, max_temperature=300.05,
+            humidity=64, pressure=1015, wind_speed=0.62, wind_degree=0
         )
         WeatherData.objects.create(
-            city='TestCity2'.lower(), temperature=298.48, min_temperature=297.56, max_temperature=300.05,
-            humidity=64, pressure=1015, wind_speed=0.62, wind_degree=0, wind_direction='North'
+            city=City.objects.create(name='TestCity2'.lower(), country='XX', latitude=0, longitude=0, active=True),
+            temperature=298.48, min_temperature=297.56, max_temperature=300.05,
+            humidity=64, pressure=1015, wind_speed=0.62, wind_degree=0
         )
         logging.disable(logging.CRITICAL)
 
@@ -75,7 +125,859 @@ class WeatherApiViewTest(TestCase):
         self.assertEqual(response_json['status'], 'error')
         self.assertEqual(response_json['message'], 'Nicht gefunden: Mit der bereitgestellten Abfrage wurde keine Stadt gefunden.')
 
+    def test_weather_api_view_cache_is_per_language(self):
+        city = 'TestCity2'
+        self.client.get(self.url, {'city': city})
+        response_json = self.client.get(self.url, {'city': city}, HTTP_ACCEPT_LANGUAGE='de').json()
+        self.assertEqual(response_json['data']['wind']['direction'], 'Norden')
+
+    def test_weather_api_view_serves_cached_response(self):
+        city = 'TestCity2'
+        self.client.get(self.url, {'city': city})
+        WeatherData.objects.filter(city__name=city.lower()).delete()
+        response = self.client.get(self.url, {'city': city})
+        self.assertEqual(response.json(), SUCCESS_RESPONSE)
+
+    def test_weather_api_view_counts_cache_lookups(self):
+        misses = metric_value('weather_cache_lookups_total', result='miss')
+        local_hits = metric_value('weather_cache_lookups_total', result='local_hit')
+        requests = metric_value('weather_api_request_seconds_count', view='WeatherApiView', method='GET', status=200)
+        self.client.get(self.url, {'city': 'TestCity2'})
+        self.client.get(self.url, {'city': 'TestCity2'})
+        self.assertEqual(metric_value('weather_cache_lookups_total', result='miss'), misses + 1)
+        self.assertEqual(metric_value('weather_cache_lookups_total', result='local_hit'), local_hits + 1)
+        self.assertEqual(
+            metric_value('weather_api_request_seconds_count', view='WeatherApiView', method='GET', status=200),
+            requests + 2,
+        )
+
+    def test_weather_api_view_batch_response(self):
+        response = self.client.get(self.url, {'city': ['TestCity1', 'TestCity2', 'NoCity']})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(data['testcity2'], SUCCESS_RESPONSE)
+        self.assertEqual(data['testcity1']['data']['city'], 'testcity1')
+        self.assertEqual(data['nocity']['message'], 'Not Found: No city found with the provided query.')
+
+    def test_weather_api_view_batch_post(self):
+        self.client.get(self.url, {'city': 'TestCity2'})
+        response = self.client.post(
+            self.url, {'cities': ['TestCity1', 'TestCity2']}, content_type='application/json'
+        )
+        self.assertEqual(list(response.json()['data']), ['testcity1', 'testcity2'])
+        response = self.client.post(self.url, {'cities': 'TestCity1'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_latest_weather_lookups_read_only_the_response_columns(self):
+        weather = await LatestWeather.objects.aget_latest(city='testcity1')
+        self.assertEqual(weather.get_deferred_fields(), set())
+        city_columns = {field.attname for field in City._meta.concrete_fields}
+        self.assertEqual(city_columns - weather.city.get_deferred_fields(), {'id', 'name'})
+        latest = await LatestWeather.objects.aget_latest_many(['testcity1', 'testcity2', 'nocity'])
+        self.assertEqual(sorted(latest), ['testcity1', 'testcity2'])
+        self.assertEqual(latest['testcity2'].to_dict()['humidity'], 64)
+
+    def test_nearby_weather_api_view_returns_nearest_city(self):
+        url = reverse('weather-nearby-api')
+        response = self.client.get(url, {'lat': 1, 'lon': -1})
+        self.assertEqual(response.json(), SUCCESS_RESPONSE)
+        response_json = self.client.get(url, {'lat': 9, 'lon': -179.5}).json()
+        self.assertEqual(response_json['data']['city'], 'testcity1')
+        self.assertEqual(self.client.get(url, {'lat': 91, 'lon': 0}).status_code, 400)
+
+    def test_nearby_weather_api_view_returns_cities_within_radius(self):
+        url = reverse('weather-nearby-api')
+        City.objects.create(name='testcity3', country='XX', latitude=14, longitude=-177, active=True)
+        response_json = self.client.get(url, {'lat': 5, 'lon': 179, 'radius': 600}).json()
+        self.assertEqual(list(response_json['data']), ['testcity1'])
+        response_json = self.client.get(url, {'lat': 9, 'lon': 180, 'radius': 800}).json()
+        self.assertEqual(list(response_json['data']), ['testcity1', 'testcity3'])
+
+    def test_nearby_weather_api_view_rejects_unbounded_radius_searches(self):
+        url = reverse('weather-nearby-api')
+        for radius in ('inf', 'nan', 1001):
+            response = self.client.get(url, {'lat': 5, 'lon': 179, 'radius': radius})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['message'], 'Bad Request: Invalid coordinates provided.')
+        City.objects.create(name='testcity3', country='XX', latitude=14, longitude=-177, active=True)
+        with override_settings(WEATHER_BATCH_MAX_CITIES=1):
+            response = self.client.get(url, {'lat': 9, 'lon': 180, 'radius': 800})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'Bad Request: At most 1 cities can be requested at once.')
+
+    async def test_asgi_lifespan_startup_loads_the_city_index(self):
+        messages, sent = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}], []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        self.assertEqual(len(city_index.grid), 0)
+        await application({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertEqual(len(city_index.grid), 2)
+
+    def test_city_autocomplete_api_view_matches_prefix(self):
+        url = reverse('city-autocomplete-api')
+        response_json = self.client.get(url, {'q': 'TestC'}).json()
+        self.assertEqual(response_json['data'], [
+            {'name': 'testcity1', 'country': 'XX'}, {'name': 'testcity2', 'country': 'XX'}
+        ])
+        self.assertEqual(self.client.get(url, {'q': ' '}).status_code, 400)
+
+    def test_city_autocomplete_api_view_matches_misspelling(self):
+        response_json = self.client.get(reverse('city-autocomplete-api'), {'q': 'tastcity2', 'limit': 1}).json()
+        self.assertEqual(response_json['data'], [{'name': 'testcity2', 'country': 'XX'}])
+
+    def test_weather_api_view_answers_if_none_match_with_304(self):
+        response = self.client.get(self.url, {'city': 'TestCity2'})
+        self.assertIn('max-age=', response.headers['Cache-Control'])
+        response = self.client.get(self.url, {'city': 'TestCity2'}, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(
+            self.url, {'city': 'TestCity2'}, HTTP_IF_NONE_MATCH=response.headers['ETag'], HTTP_ACCEPT_LANGUAGE='de'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_weather_api_view_answers_if_modified_since_with_304(self):
+        response = self.client.get(self.url, {'city': 'TestCity2'})
+        response = self.client.get(
+            self.url, {'city': 'TestCity2'}, HTTP_IF_MODIFIED_SINCE=response.headers['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(WEATHER_REFRESH_INTERVAL_IN_MIN=60, WEATHER_MIN_REFRESH_INTERVAL_IN_MIN=10)
+    def test_weather_api_view_caches_responses_until_the_scheduled_refresh(self):
+        today = timezone.now().date()
+        # hits counted by other tests
+        cache.delete_many([city_hits_key('testcity1', day) for day in (today, today - timedelta(days=1))])
+        cache.set(city_hits_key('testcity2', today), 10_000)
+        self.addCleanup(cache.delete, city_hits_key('testcity2', today))
+        self.assertAlmostEqual(get_max_age(self.client.get(self.url, {'city': 'TestCity1'})), 3600, delta=60)
+        response = self.client.get(self.url, {'city': 'TestCity2'})
+        self.assertAlmostEqual(get_max_age(response), 600, delta=60)
+        response = self.client.get(self.url, {'city': 'TestCity2'}, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertAlmostEqual(get_max_age(response), 600, delta=60)
+
+    async def test_weather_api_view_revalidates_without_loading_the_response(self):
+        response = await self.async_client.get(self.url, {'city': 'TestCity2'})
+        etag = response.headers['ETag']
+        await cache.adelete_many(weather_cache_keys('testcity2'))
+        local_cache.clear()
+        await LatestWeather.objects.filter(city__name='testcity2').adelete()
+        response = await self.async_client.get(self.url, {'city': 'TestCity2'}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # a newer observation landed, so the request goes on to load it
+        await ainvalidate_weather({'testcity2': timezone.now()})
+        response = await self.async_client.get(self.url, {'city': 'TestCity2'}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_weather_api_view_revalidates_cities_loaded_by_a_batch_without_loading_them(self):
+        last_modified = (await LatestWeather.objects.aget(city__name='testcity2')).timestamp
+        await self.async_client.get(self.url, {'city': ['TestCity1', 'TestCity2']})
+        await cache.adelete_many(weather_cache_keys('testcity2'))
+        local_cache.clear()
+        await LatestWeather.objects.filter(city__name='testcity2').adelete()
+        response = await self.async_client.get(
+            self.url, {'city': 'TestCity2'}, headers={'If-Modified-Since': http_date(last_modified.timestamp())}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def add_history(self) -> None:
+        city = City.objects.get(name='testcity1')
+        now = timezone.now()
+        for hours in (1, 2, 2):
+            weather_data = WeatherData.objects.create(
+                city=city, temperature=290 + hours, min_temperature=290, max_temperature=300,
+                humidity=50, pressure=1000, wind_speed=1, wind_degree=0
+            )
+            WeatherData.objects.filter(pk=weather_data.pk).update(timestamp=now - timedelta(hours=hours))
+        WeatherAggregate.objects.create(
+            city='testcity1', period=WeatherAggregate.HOUR, bucket=(now - timedelta(days=2)).replace(minute=0),
+            samples=4, avg_temperature=280, min_temperature=275, max_temperature=285,
+            avg_humidity=50, avg_pressure=1000, avg_wind_speed=1, max_wind_speed=2
+        )
+
+    def test_weather_history_api_view_paginates_buckets(self):
+        self.add_history()
+        url = reverse('weather-history-api')
+        response_json = self.client.get(url, {'city': 'TestCity1', 'limit': 2}).json()
+        self.assertEqual([row['samples'] for row in response_json['data']], [4, 2])
+        self.assertEqual(response_json['data'][1]['avg_temperature'], 292.0)
+        response_json = self.client.get(url, {'city': 'TestCity1', 'limit': 2, 'after': response_json['next']}).json()
+        self.assertEqual([row['avg_temperature'] for row in response_json['data']], [291.0, 298.48])
+        response = self.client.get(url, {'city': 'TestCity1', 'interval': 'week'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_weather_history_api_view_pages_raw_rows_within_a_millisecond(self):
+        city = City.objects.get(name='testcity1')
+        timestamp = (timezone.now() - timedelta(hours=1)).replace(microsecond=500)
+        for temperature, microseconds in ((280, 0), (281, 200), (282, 200), (283, 400)):
+            weather_data = WeatherData.objects.create(
+                city=city, temperature=temperature, min_temperature=270, max_temperature=310,
+                humidity=50, pressure=1000, wind_speed=1, wind_degree=0
+            )
+            timestamp_of_row = timestamp + timedelta(microseconds=microseconds)
+            WeatherData.objects.filter(pk=weather_data.pk).update(timestamp=timestamp_of_row)
+
+        temperatures, query = [], {'city': 'TestCity1', 'interval': 'raw', 'limit': 1}
+        for _ in range(10):
+            response_json = self.client.get(reverse('weather-history-api'), query).json()
+            temperatures += [row['temperature'] for row in response_json['data']]
+            if not response_json['next']:
+                break
+            query['after'] = response_json['next']
+        self.assertEqual(temperatures, [280, 281, 282, 283, 298.48])
+
+    async def test_weather_history_api_view_streams_ndjson(self):
+        await sync_to_async(self.add_history)()
+        response = await self.async_client.get(
+            reverse('weather-history-api'), {'city': 'TestCity1', 'interval': 'raw', 'format': 'ndjson'}
+        )
+        rows = [json.loads(line) for line in b''.join([chunk async for chunk in response]).splitlines()]
+        self.assertEqual([row['temperature'] for row in rows], [292.0, 292.0, 291.0, 298.48])
+
+    def tearDown(self) -> None:
+        logging.disable(logging.NOTSET)
+        cache.delete_many([
+            *weather_cache_keys('testcity1'), *weather_cache_keys('testcity2'),
+            weather_modified_key('testcity1'), weather_modified_key('testcity2'),
+        ])
+        local_cache.clear()
+        city_index.clear()
+        city_names.clear()
+
+
+class ManageWeatherHistoryTest(TestCase):
+    def setUp(self) -> None:
+        city = City.objects.create(name='testcity1', country='XX', latitude=0, longitude=0, active=True)
+        self.now = timezone.now()
+        self.expired = self.now - timedelta(days=150)
+        for timestamp, temperature in ((self.expired, 280), (self.expired, 290), (self.now, 300)):
+            weather_data = WeatherData.objects.create(
+                city=city, temperature=temperature, min_temperature=270, max_temperature=310,
+                humidity=50, pressure=1000, wind_speed=1, wind_degree=0
+            )
+            WeatherData.objects.filter(pk=weather_data.pk).update(timestamp=timestamp)
+
+    def assert_expired_rows_rolled_up(self) -> None:
+        self.assertEqual(list(WeatherData.objects.values_list('temperature', flat=True)), [300])
+        for period in (WeatherAggregate.HOUR, WeatherAggregate.DAY):
+            aggregate = WeatherAggregate.objects.get(period=period)
+            self.assertEqual((aggregate.samples, aggregate.avg_temperature), (2, 285))
+
+    def test_manage_weather_history_rolls_up_and_deletes_rows_in_batches(self):
+        # the path of databases without partitioning, such as SQLite
+        command = ManageWeatherHistory(stdout=StringIO())
+        command.expire_rows(add_months(month_start(self.now), -3), batch_size=1)
+        self.assert_expired_rows_rolled_up()
+
+    @skipUnless(connection.vendor == 'postgresql', 'partitions need PostgreSQL')
+    def test_manage_weather_history_rolls_up_and_drops_expired_partitions(self):
+        call_command('manage_weather_history', retention=3, premake=1, stdout=StringIO())
+        self.assert_expired_rows_rolled_up()
+        partitions = ManageWeatherHistory().get_partitions()
+        self.assertNotIn(month_start(self.expired), partitions)
+        self.assertIn(month_start(self.now), partitions)
+        self.assertIn(add_months(month_start(self.now), 1), partitions)
+
+
+class StubCityLoader:
+    """Stands in for CityLoader with the rows of an already parsed city list."""
+
+    def __init__(self, cities: list[CityData], override: bool = False) -> None:
+        self.cities = cities
+        self.override = override
+
+    async def get_city_chunks(self, size: int):
+        for start in range(0, len(self.cities), size):
+            yield self.cities[start:start + size]
+
+
+class PopulateCountriesTest(TestCase):
+    cities = [
+        CityData('Dhaka', 90.407501, 23.710396, 'BD'),
+        CityData('Berlin', '13.41053', '52.524368', 'DE'),
+        CityData('dhaka', 0, 0, 'XX'),  # a second row of a name, in another chunk
+        CityData('Hamburg', 10.0, 53.549999, 'DE'),
+        CityData('Munich', 11.57549, 48.137428, 'DE'),
+    ]
+
+    async def load_cities(self, cities: list[CityData], override: bool = False) -> dict[str, int]:
+        command = PopulateCountries(stdout=StringIO())
+        command.chunk_size = 2
+        return await command.load_cities(StubCityLoader(cities, override=override))
+
+    async def test_populate_countries_inserts_the_first_row_of_each_city_in_chunks(self):
+        counts = await self.load_cities(self.cities)
+        self.assertEqual(counts, {'inserted': 4, 'updated': 0, 'unchanged': 0, 'skipped': 0})
+        dhaka = await City.objects.aget(name='dhaka')
+        self.assertEqual(
+            (dhaka.country, dhaka.latitude, dhaka.longitude), ('BD', Decimal('23.710396'), Decimal('90.407501'))
+        )
+        self.assertEqual(await City.objects.acount(), 4)
+
+    async def test_populate_countries_counts_an_unchanged_list_as_unchanged(self):
+        await self.load_cities(self.cities)
+        last_updates = {city.name: city.last_update async for city in City.objects.all()}
+        counts = await self.load_cities(self.cities)
+        self.assertEqual(counts, {'inserted': 0, 'updated': 0, 'unchanged': 4, 'skipped': 0})
+        self.assertEqual({city.name: city.last_update async for city in City.objects.all()}, last_updates)
+
+    async def test_populate_countries_keeps_existing_cities_without_override(self):
+        await City.objects.acreate(name='dhaka', country='BD', latitude=23.7, longitude=90.4, openweather_id=1185241)
+        await City.objects.acreate(name='berlin', country='DE', latitude='52.524368', longitude='13.410530')
+        counts = await self.load_cities(self.cities)
+        self.assertEqual(counts, {'inserted': 2, 'updated': 0, 'unchanged': 1, 'skipped': 1})
+        dhaka = await City.objects.aget(name='dhaka')
+        self.assertEqual((dhaka.latitude, dhaka.longitude), (Decimal('23.7'), Decimal('90.4')))
+
+    async def test_populate_countries_updates_changed_cities_with_override(self):
+        dhaka = await City.objects.acreate(
+            name='dhaka', country='BD', latitude=23.7, longitude=90.4, active=True, openweather_id=1185241
+        )
+        counts = await self.load_cities(self.cities, override=True)
+        self.assertEqual(counts, {'inserted': 3, 'updated': 1, 'unchanged': 0, 'skipped': 0})
+        updated = await City.objects.aget(name='dhaka')
+        self.assertEqual((updated.latitude, updated.longitude), (Decimal('23.710396'), Decimal('90.407501')))
+        # only the changed columns are written, and the coordinate index sees the move
+        self.assertEqual((updated.pk, updated.active, updated.openweather_id), (dhaka.pk, True, 1185241))
+        self.assertGreater(updated.last_update, dhaka.last_update)
+
+
+class FakeFileServer:
+    """
+    aiohttp server for city lists, answering conditional and range requests like a static file server.
+    attributes:
+        files (dict[str, bytes]): The content of every file by name, which a test may change between downloads.
+        etags (bool): Whether responses carry an ETag, or only a Last-Modified.
+        cut_after (Optional[int]): Bytes of the next response sent before the connection is dropped.
+        statuses (Counter): Number of responses sent per status code.
+        requests (list[dict[str, str]]): The headers of every request.
+    """
+
+    last_modified = http_date(1729220400)
+
+    def __init__(self, files: dict[str, bytes], etags: bool = True) -> None:
+        self.files = files
+        self.etags = etags
+        self.cut_after = None
+        self.statuses = Counter()
+        self.requests = []
+        self._runner = None
+        self._port = None
+
+    def url(self, name: str) -> str:
+        return f'http://127.0.0.1:{self._port}/{name}'
+
+    async def __aenter__(self) -> 'FakeFileServer':
+        app = web.Application()
+        app.router.add_get('/{name}', self.serve)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self._port = sock.getsockname()[1]
+        await web.SockSite(self._runner, sock).start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._runner.cleanup()
+
+    async def serve(self, request: web.Request) -> web.StreamResponse:
+        self.requests.append(dict(request.headers))
+        body = self.files[request.match_info['name']]
+        headers = {'Last-Modified': self.last_modified}
+        if self.etags:
+            headers['ETag'] = f'"{hashlib.md5(body).hexdigest()}"'
+        validator = headers.get('ETag', self.last_modified)
+
+        if 'If-None-Match' in request.headers:
+            not_modified = request.headers['If-None-Match'] == headers.get('ETag')
+        else:
+            modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+            not_modified = modified_since is not None and modified_since >= parse_http_date_safe(self.last_modified)
+        status, start = 200, 0
+        if not_modified:
+            status, body = 304, b''
+        elif (byte_range := request.headers.get('Range')) and request.headers.get('If-Range', validator) == validator:
+            status, start = 206, int(byte_range.removeprefix('bytes=').removesuffix('-'))
+            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+        self.statuses[status] += 1
+
+        if self.cut_after is None:
+            return web.Response(body=body[start:], status=status, headers=headers)
+        response = web.StreamResponse(status=status, headers={**headers, 'Content-Length': str(len(body) - start)})
+        await response.prepare(request)
+        await response.write(body[start:start + self.cut_after])
+        self.cut_after = None
+        request.transport.close()
+        return response
+
+
+class CityLoaderTest(SimpleTestCase):
+    cities = [CityData('Dhaka', 90.407501, 23.710396, 'BD'), CityData('Berlin', 13.41053, 52.524368, 'DE')]
+    csv_list = b'name,lon,lat,country\n' + b''.join(f'{c.name},{c.lon},{c.lat},{c.country}\n'.encode() for c in cities)
+    json_list = json.dumps([
+        {'id': index, 'name': c.name, 'country': c.country, 'coord': {'lon': c.lon, 'lat': c.lat}}
+        for index, c in enumerate(cities)
+    ]).encode()
+
+    def setUp(self) -> None:
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        self.download_dir = download_dir.name
+
+    async def load(self, url: str, **options) -> list[CityData]:
+        return [city async for city in CityLoader(url, download_dir=self.download_dir, **options).get_cities()]
+
+    async def test_city_loader_reads_csv_and_json_lists_gzipped_or_not(self):
+        files = {
+            'cities.csv': self.csv_list, 'cities.csv.gz': gzip.compress(self.csv_list),
+            'cities.json': self.json_list, 'cities.json.gz': gzip.compress(self.json_list),
+        }
+        as_text = [CityData(c.name, str(c.lon), str(c.lat), c.country) for c in self.cities]
+        async with FakeFileServer(files) as server:
+            for name, expected in [
+                ('cities.csv', as_text), ('cities.csv.gz', as_text),
+                ('cities.json', self.cities), ('cities.json.gz', self.cities),
+            ]:
+                with self.subTest(name=name):
+                    self.assertEqual(await self.load(server.url(name)), expected)
+
+    async def test_city_loader_skips_a_list_that_did_not_change(self):
+        for etags in True, False:
+            with self.subTest(etags=etags):
+                async with FakeFileServer({f'{etags}.json': self.json_list}, etags=etags) as server:
+                    url = server.url(f'{etags}.json')
+                    self.assertEqual(await self.load(url), self.cities)
+                    self.assertEqual(await self.load(url), [])
+                    self.assertEqual(server.statuses[304], 1)
+                    self.assertEqual(await self.load(url, force=True), self.cities)
+                    server.files[f'{etags}.json'] = self.json_list.replace(b'Dhaka', b'Dacca')
+                    if not etags:
+                        server.last_modified = http_date(1729220400 + 60)
+                    self.assertEqual((await self.load(url))[0].name, 'Dacca')
+
+    async def test_city_loader_resumes_an_interrupted_download(self):
+        async with FakeFileServer({'cities.json': self.json_list}) as server:
+            server.cut_after = 20
+            with self.assertRaises(ClientPayloadError):
+                await self.load(server.url('cities.json'))
+            self.assertEqual(await self.load(server.url('cities.json')), self.cities)
+        self.assertEqual(server.statuses, Counter({200: 1, 206: 1}))
+        self.assertEqual(server.requests[1]['Range'], 'bytes=20-')
+
+    async def test_city_loader_downloads_a_list_again_when_it_changed_during_a_resume(self):
+        async with FakeFileServer({'cities.json': self.json_list}) as server:
+            server.cut_after = 20
+            with self.assertRaises(ClientPayloadError):
+                await self.load(server.url('cities.json'))
+            server.files['cities.json'] = self.json_list.replace(b'Dhaka', b'Dacca')
+            self.assertEqual((await self.load(server.url('cities.json')))[0].name, 'Dacca')
+        self.assertEqual(server.statuses, Counter({200: 2}))
+
+
+class WeatherReportParsingTest(SimpleTestCase):
+    payload = (Path(__file__).resolve().parent / 'testdata' / 'openweather_group.json').read_bytes()
+
+    def test_batch_matches_per_report_parsing(self):
+        items = json_loads(self.payload)['list']
+        batch = WeatherReportBatch.from_json_list(items + [{'name': 'broken', 'main': None}])
+        self.assertEqual(len(batch), 20)
+        self.assertEqual(list(batch), [WeatherReport.from_json_response(item) for item in items])
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.network = FailurePolicy('network', min_requests=2, cool_down=0)
+        self.auth = FailurePolicy('auth', max_failures=1, cool_down=60)
+        self.circuit_breaker = CircuitBreaker({UnexpectedError: self.network, UnauthorizedError: self.auth})
+
+    def test_circuit_breaker_opens_on_a_single_auth_failure_after_successes(self):
+        for _ in range(10):
+            self.circuit_breaker.record_success()
+        self.circuit_breaker.record_failure(UnexpectedError('timeout'))
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.CLOSED)
+        self.circuit_breaker.record_failure(UnauthorizedError('invalid API key'))
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.OPEN)
+        self.assertIs(self.circuit_breaker.opened_by, self.auth)
+
+    async def test_circuit_breaker_keeps_a_throttled_probe_from_closing_it(self):
+        for _ in range(2):
+            self.circuit_breaker.record_failure(UnexpectedError('timeout'))
+        self.assertTrue(await self.circuit_breaker.allow())
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.HALF_OPEN)
+        self.circuit_breaker.record_throttled(retry_after=0)
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(await self.circuit_breaker.allow())
+        self.circuit_breaker.record_success()
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.CLOSED)
+
+
+class FakeClock:
+    """Stands in for the monotonic clock of the rate limiter, and sleeps by moving it forward."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.real_sleep = asyncio.sleep
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.now += seconds
+        await self.real_sleep(0)
+
+
+class RateLimiterTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patchers = [mock.patch('loader.rate_limiter.time', self.clock), mock.patch('asyncio.sleep', self.clock.sleep)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_token_bucket_refills_at_its_rate_up_to_its_capacity(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        await bucket.acquire()
+        await bucket.acquire()
+        self.assertEqual(self.clock.now, 0)
+        await bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 0.1)
+        self.clock.now += 60
+        await bucket.acquire()
+        await bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 60.1)
+        await bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 60.2)
+
+    async def test_token_bucket_hands_out_no_tokens_during_a_pause(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        bucket.pause(5)
+        bucket.pause(1)  # a shorter Retry-After does not cut the pause short
+        await bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 5)
+        await bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 5)
+
+    def test_adaptive_concurrency_grows_additively_up_to_the_maximum(self):
+        concurrency = AdaptiveConcurrency(initial=3, maximum=5)
+        concurrency.on_success(0.1)
+        self.assertEqual(concurrency.limit, 4)
+        for _ in range(3):
+            concurrency.on_success(0.1)
+        self.assertEqual(concurrency.limit, 5)
+
+    def test_adaptive_concurrency_shrinks_multiplicatively_down_to_the_minimum(self):
+        concurrency = AdaptiveConcurrency(initial=12, minimum=2)
+        concurrency.on_throttle()
+        self.assertEqual(concurrency.limit, 6)
+        concurrency.on_success(0.1)
+        concurrency.on_success(0.5)  # a latency spike counts as throttling
+        self.assertEqual(concurrency.limit, 3)
+        concurrency.on_throttle()
+        concurrency.on_throttle()
+        self.assertEqual(concurrency.limit, 2)
+
+    async def test_adaptive_concurrency_holds_requests_beyond_the_limit(self):
+        concurrency = AdaptiveConcurrency(initial=1)
+        entered = []
+
+        async def request(name):
+            async with concurrency:
+                entered.append(name)
+                await self.clock.real_sleep(0.01)
+
+        first, second = asyncio.create_task(request('first')), asyncio.create_task(request('second'))
+        await self.clock.real_sleep(0)
+        self.assertEqual(entered, ['first'])
+        await asyncio.gather(first, second)
+        self.assertEqual(entered, ['first', 'second'])
+
+
+class WeatherLoaderTest(TestCase):
+    def setUp(self) -> None:
+        City.objects.bulk_create([
+            City(name=f'city{i}', country='XX', latitude=i, longitude=i, active=True, openweather_id=i or None)
+            for i in range(25)
+        ])
+        logging.disable(logging.CRITICAL)
+
     def tearDown(self) -> None:
         logging.disable(logging.NOTSET)
-        cache.delete('testcity1')
-        cache.delete('testcity2')
+
+    async def run_loader(self, server: FakeOpenWeather, **options) -> WeatherLoader:
+        async with OpenWeatherAPIClient(api_key='fake', base_url=server.base_url) as client:
+            loader = WeatherLoader(client=client, calls_per_minute=6000, max_workers=4, **options)
+            await loader.run()
+        return loader
+
+    async def refresh_shards(self, server: FakeOpenWeather, shards: list[Shard], **options) -> list[Shard]:
+        async with OpenWeatherAPIClient(api_key='fake', base_url=server.base_url) as client:
+            loader = WeatherLoader(client=client, calls_per_minute=6000, max_workers=4)
+            return await arefresh_shards(loader, shards, **options)
+
+    async def test_weather_loader_fetches_every_city_from_stand_in(self):
+        async with FakeOpenWeather(latency=0.01, throttle_rate=0.3, retry_after=0, seed=1) as server:
+            await self.run_loader(server)
+        self.assertEqual(await LatestWeather.objects.acount(), 25)
+        self.assertGreater(server.statuses[429], 0)
+        city = await City.objects.aget(name='city0')
+        self.assertGreater(city.openweather_id, 10 ** 9)
+
+    async def test_weather_loader_looks_cities_up_by_their_exact_coordinates(self):
+        await City.objects.filter(name='city0').aupdate(latitude=Decimal('51.5074'), longitude=Decimal('-0.1278'))
+        async with FakeOpenWeather() as server:
+            await self.run_loader(server)
+        city = await City.objects.aget(name='city0')
+        # the stand-in derives the ID from the coordinates it was sent, to the hundredth of a degree
+        self.assertEqual(city.openweather_id, 10 ** 9 + int((51.5074 + 90) * 100) * 36001 + int((-0.1278 + 180) * 100))
+
+    async def test_weather_loader_runs_again_after_a_run(self):
+        async with FakeOpenWeather() as server:
+            async with OpenWeatherAPIClient(api_key='fake', base_url=server.base_url) as client:
+                loader = WeatherLoader(client=client, calls_per_minute=6000, max_workers=4)
+                await asyncio.wait_for(loader.run(), timeout=10)
+                await asyncio.wait_for(loader.run(), timeout=10)
+        self.assertEqual(await WeatherData.objects.acount(), 50)
+
+    async def test_weather_loader_retries_cities_after_network_outage(self):
+        retried = metric_value('weather_loader_cities_retried_total')
+        network_policy = FailurePolicy('network', min_requests=2, cool_down=0.05)
+        async with FakeOpenWeather(error_first=3) as server:
+            loader = await self.run_loader(server, network_policy=network_policy)
+        self.assertEqual(await LatestWeather.objects.acount(), 25)
+        self.assertEqual(loader.circuit_breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(metric_value('weather_loader_cities_retried_total'), retried + 25)
+        self.assertEqual(loader.cities_failed, 0)
+
+    async def test_weather_loader_gives_up_on_auth_failures(self):
+        async with FakeOpenWeather(error_rate=1, error_status=401) as server:
+            loader = await self.run_loader(server)
+        self.assertTrue(loader.is_circuit_breaker_open)
+        self.assertEqual(loader.circuit_breaker.opened_by.name, 'auth')
+        self.assertEqual(await LatestWeather.objects.acount(), 0)
+        self.assertEqual(loader.cities_failed, 25)
+        self.assertLessEqual(server.statuses[401], 3)
+        self.assertEqual(metric_value('weather_loader_circuit_breaker_state'), 2)
+
+    async def start_writer(self, loader: WeatherLoader) -> tuple[asyncio.Task, list[int]]:
+        """Start the writer stage of ``loader`` alone, recording the size of every batch it writes."""
+        batch_sizes = []
+        write_batch = loader.write_batch
+
+        async def record_batch(city_reports):
+            batch_sizes.append(len(city_reports))
+            await write_batch(city_reports)
+
+        loader.write_batch = record_batch
+        return asyncio.create_task(loader.write_to_db()), batch_sizes
+
+    async def queue_reports(self, loader: WeatherLoader, count: int) -> None:
+        async for city in City.objects.order_by('pk')[:count]:
+            report = WeatherReport(city.name, 280.0, 279.0, 281.0, 50, 1000, 1.5, 90, city.openweather_id)
+            await loader.db_writer_queue.put((city, report))
+
+    async def test_weather_loader_writes_a_full_batch_without_waiting(self):
+        loader = WeatherLoader(client=None, batch_size=10, flush_interval=60)
+        writer, batch_sizes = await self.start_writer(loader)
+        await self.queue_reports(loader, 25)
+        await loader.db_writer_queue.put(None)
+        await asyncio.wait_for(writer, timeout=10)
+        self.assertEqual(batch_sizes, [10, 10, 5])
+        self.assertEqual(await WeatherData.objects.acount(), 25)
+
+    async def test_weather_loader_writes_a_partial_batch_after_the_flush_interval(self):
+        loader = WeatherLoader(client=None, batch_size=100, flush_interval=0.05)
+        writer, batch_sizes = await self.start_writer(loader)
+        await self.queue_reports(loader, 3)
+        await asyncio.wait_for(loader.db_writer_queue.join(), timeout=10)
+        self.assertEqual(batch_sizes, [3])
+        self.assertFalse(writer.done())
+        await loader.db_writer_queue.put(None)
+        await asyncio.wait_for(writer, timeout=10)
+        self.assertEqual(batch_sizes, [3])
+        self.assertEqual(await WeatherData.objects.acount(), 3)
+
+    async def test_weather_loader_stores_the_hottest_temperatures_on_record(self):
+        city = await City.objects.aget(name='city1')
+        report = WeatherReport(city.name, 330.15, 327.65, 331.25, 5, 1005, 12.5, 90, city.openweather_id)
+        await WeatherData.objects.abulk_insert([WeatherData.from_weather_report(report, city=city)])
+        latest = await LatestWeather.objects.aget(city=city)
+        self.assertEqual(
+            (latest.temperature, latest.min_temperature, latest.max_temperature),
+            (Decimal('330.15'), Decimal('327.65'), Decimal('331.25')),
+        )
+
+    async def test_weather_loader_shuts_down_when_a_stage_fails(self):
+        async def fail(*args):
+            raise RuntimeError('stage failed')
+
+        for stage in 'fetch_weather_by_cities', 'write_batch':
+            with self.subTest(stage=stage):
+                tasks = asyncio.all_tasks()
+                async with FakeOpenWeather() as server:
+                    async with OpenWeatherAPIClient(api_key='fake', base_url=server.base_url) as client:
+                        loader = WeatherLoader(client=client, calls_per_minute=6000, max_workers=4, batch_size=5)
+                        setattr(loader, stage, fail)
+                        with self.assertRaises(ExceptionGroup) as caught:
+                            await asyncio.wait_for(loader.run(), timeout=10)
+                self.assertIsNotNone(caught.exception.subgroup(RuntimeError))
+                self.assertEqual(asyncio.all_tasks() - tasks, set())
+        # nothing is left over that would keep the next run from finishing
+        async with FakeOpenWeather() as server:
+            await self.run_loader(server)
+        self.assertEqual(await LatestWeather.objects.acount(), 25)
+
+    async def test_metrics_endpoint_exposes_loader_metrics(self):
+        throttled = metric_value('weather_loader_throttled_total')
+        runs = metric_value('weather_loader_runs_total')
+        async with FakeOpenWeather(throttle_rate=0.5, retry_after=0, seed=1) as server:
+            await self.run_loader(server)
+        self.assertGreater(metric_value('weather_loader_throttled_total'), throttled)
+        self.assertEqual(metric_value('weather_loader_runs_total'), runs + 1)
+        self.assertEqual(metric_value('weather_loader_last_run_cities_written'), 25)
+
+        processes = await sync_to_async(metrics._get_processes)()
+        response = await self.async_client.get(reverse('metrics'))
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE weather_loader_upstream_request_seconds histogram', lines)
+        self.assertIn('weather_loader_last_run_cities_written 25.0', lines)
+        self.assertIn('weather_loader_queue_depth{queue="request"} 0.0', lines)
+        self.assertIn(f'weather_loader_runs_total {runs + 1}', lines)
+        self.assertEqual(await sync_to_async(metrics._get_processes)(), processes)  # scrapes only read
+
+    @override_settings(METRICS_TOKEN='secret')
+    async def test_metrics_endpoint_requires_the_token_when_set(self):
+        response = await self.async_client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        response = await self.async_client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE weather_loader_runs_total counter', response.content.decode().splitlines())
+
+    async def test_weather_loader_refreshes_each_city_of_the_shards_once(self):
+        shards = Shard.all(3)
+        city_ids = [[city.pk async for city in shard.filter(City.objects.all())] for shard in shards]
+        self.assertCountEqual(sum(city_ids, []), [city.pk async for city in City.objects.all()])
+        async with FakeOpenWeather() as server:
+            refreshed = await self.refresh_shards(server, shards)
+        self.assertEqual(refreshed, shards)
+        self.assertEqual(await WeatherData.objects.acount(), 25)
+
+    @skipUnless(connection.vendor == 'postgresql', 'advisory locks need PostgreSQL')
+    async def test_weather_loader_skips_shards_claimed_by_other_workers(self):
+        claimed = Shard(1, 2)
+
+        def claim_from_other_session():
+            other = connections.create_connection('default')
+            with other.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_lock(%s, %s)', [SHARD_LOCK_NAMESPACE, claimed.lock_key])
+            return other
+
+        other = await sync_to_async(claim_from_other_session)()
+        try:
+            async with FakeOpenWeather() as server:
+                refreshed = await self.refresh_shards(server, Shard.all(2), claim_timeout=0)
+        finally:
+            await sync_to_async(other.close)()
+        self.assertEqual(refreshed, [Shard(0, 2)])
+        self.assertEqual(await WeatherData.objects.acount(), await Shard(0, 2).filter(City.objects.all()).acount())
+
+    @skipUnless(connection.vendor == 'postgresql', 'advisory locks need PostgreSQL')
+    async def test_weather_loader_gives_up_on_a_shard_whose_lock_was_lost(self):
+        fetch_weather_by_cities = WeatherLoader.fetch_weather_by_cities
+
+        def end_lock_session():
+            other = connections.create_connection('default')
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_terminate_backend(pid) FROM pg_locks '
+                    'WHERE locktype = %s AND classid = %s AND objid = %s',
+                    ['advisory', SHARD_LOCK_NAMESPACE, Shard(0, 1).lock_key],
+                )
+            other.close()
+
+        async def fetch_after_losing_the_lock(loader, cities):
+            await sync_to_async(end_lock_session)()
+            return await fetch_weather_by_cities(loader, cities)
+
+        with mock.patch.object(WeatherLoader, 'fetch_weather_by_cities', fetch_after_losing_the_lock):
+            async with FakeOpenWeather() as server:
+                refreshed = await asyncio.wait_for(self.refresh_shards(server, [Shard(0, 1)]), timeout=10)
+        self.assertEqual(refreshed, [])
+        self.assertEqual(await WeatherData.objects.acount(), 0)
+        # the lock of the shard is free again for the next run
+        lock = await atry_claim(Shard(0, 1))
+        self.assertIsNotNone(lock)
+        await lock.arelease()
+
+
+class RefreshSchedulerTest(TestCase):
+    def setUp(self) -> None:
+        now = timezone.now()
+        self.cities = {
+            name: City.objects.create(
+                name=name, country='XX', latitude=index, longitude=index, active=True, openweather_id=index + 1,
+                weather_updated_at=updated_at,
+            )
+            for index, (name, updated_at) in enumerate([
+                ('never-refreshed', None),
+                ('fresh', now),
+                ('popular', now - timedelta(minutes=20)),
+                ('stale', now - timedelta(hours=2)),
+            ])
+        }
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self) -> None:
+        logging.disable(logging.NOTSET)
+        days = [timezone.now().date() - timedelta(days=days) for days in (0, 1)]
+        cache.delete_many([city_hits_key(name, day) for name in self.cities for day in days])
+
+    def test_refresh_scheduler_shortens_the_interval_of_popular_cities(self):
+        scheduler = RefreshScheduler(loader=None, refresh_interval=3600, min_refresh_interval=600, hot_city_hits=100)
+        self.assertEqual(scheduler.get_refresh_interval(0), 3600)
+        self.assertEqual(scheduler.get_refresh_interval(100), 1800)
+        self.assertEqual(scheduler.get_refresh_interval(10_000), 600)
+
+    async def test_refresh_scheduler_refreshes_the_cities_that_are_due(self):
+        for _ in range(1000):
+            await arecord_city_hit('popular')
+        async with FakeOpenWeather() as server:
+            async with OpenWeatherAPIClient(api_key='fake', base_url=server.base_url) as client:
+                loader = WeatherLoader(client=client, calls_per_minute=6000, max_workers=4)
+                scheduler = RefreshScheduler(loader, refresh_interval=3600, min_refresh_interval=600)
+                await scheduler.load_schedule()
+                due = scheduler.pop_due()
+                self.assertCountEqual(due, [self.cities[name].pk for name in ('never-refreshed', 'popular', 'stale')])
+                await scheduler.refresh(due)
+        self.assertEqual(scheduler.pop_due(), [])
+        self.assertEqual(len(scheduler.schedule), 4)
+        for name in 'never-refreshed', 'popular', 'stale':
+            city = await City.objects.aget(name=name)
+            self.assertGreater(city.weather_updated_at, self.cities['fresh'].weather_updated_at)
+            self.assertEqual(city.last_update, self.cities[name].last_update)  # left to edits of the city
+
+    async def test_city_hits_cover_the_last_day(self):
+        await arecord_city_hit('popular')
+        await arecord_city_hit('Popular')
+        self.assertEqual(await aget_city_hits(['popular', 'stale']), {'popular': 2, 'stale': 0})
+        six_am = datetime(2026, 10, 18, 6, tzinfo=dt_timezone.utc)
+        await cache.aset(city_hits_key('popular', six_am.date()), 10)
+        await cache.aset(city_hits_key('popular', six_am.date() - timedelta(days=1)), 100)
+        with mock.patch('django.utils.timezone.now', return_value=six_am):
+            # three quarters of the previous day fall within the last 24 hours
+            self.assertEqual(await aget_city_hits(['popular']), {'popular': 85})
+            await arecord_city_hit('popular')
+            self.assertEqual(await aget_city_hits(['popular']), {'popular': 86})
+        cache.delete_many([city_hits_key('popular', six_am.date() - timedelta(days=days)) for days in (0, 1)])
@@ -1,6 +1,9 @@
 from django.urls import path
-from .views import WeatherApiView
+from .views import CityAutocompleteApiView, NearbyWeatherApiView, WeatherApiView, WeatherHistoryApiView
 
 urlpatterns = [
     path('weather/', WeatherApiView.as_view(), name='weather-api'),
+    path('cities/', CityAutocompleteApiView.as_view(), name='city-autocomplete-api'),
+    path('weather/nearby/', NearbyWeatherApiView.as_view(), name='weather-nearby-api'),
+    path('weather/history/', WeatherHistoryApiView.as_view(), name='weather-history-api'),
 ]
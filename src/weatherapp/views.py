@@ -1,51 +1,201 @@
+import asyncio
+import hashlib
+import hmac
+import json
 import logging
-from typing import Any, Optional
-from django.core.cache import cache
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import gettext as _
+from prometheus_client import CONTENT_TYPE_LATEST
+from loader.scheduler import aget_next_refreshes
 
-from .models import WeatherData
+from . import metrics
+from .autocomplete import city_names
+from .cache import (
+    CachedResponse,
+    aadd_weather_modified,
+    aget_or_load,
+    aget_or_load_many,
+    aget_weather_modified,
+    arecord_city_hit,
+    weather_cache_key,
+)
+from .models import City, LatestWeather, WeatherData
+from .spatial import city_index
 
 logger = logging.getLogger(__name__)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
 class WeatherApiView(View):
     """
-    API View to retrieve weather information for a given city.
-    This view supports GET requests with the 'city' parameter in the query string.
+    API View to retrieve weather information for one or many cities.
+    This view supports GET requests with the 'city' parameter in the query string,
+    repeated to get several cities at once, and POST requests with a JSON body of
+    the form {"cities": [...]}. Several cities are answered with a map keyed by city.
     """
 
     error_messages: dict[int: str] = {
         400: _('Bad Request: No city provided.'),
         404: _('Not Found: No city found with the provided query.'),
     }
-    weather_report: Optional[dict[str, Any]] = None
+    too_many_cities_message = _('Bad Request: At most %(limit)d cities can be requested at once.')
+    weather_report: Optional[CachedResponse] = None
+    cache_key: Optional[str] = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        started_at = time.perf_counter()
+        response = await super().dispatch(request, *args, **kwargs)
+        metrics.API_REQUEST_SECONDS.labels(
+            view=type(self).__name__, method=request.method, status=response.status_code
+        ).observe(time.perf_counter() - started_at)
+        metrics.publish_if_due()
+        return response
+
+    @staticmethod
+    def _serialize(weather_data: LatestWeather, next_refresh: datetime) -> CachedResponse:
+        success_response = {'status': 'success', 'data': weather_data.to_dict()}
+        content = json.dumps(success_response, cls=DjangoJSONEncoder).encode()
+        return CachedResponse(content, weather_data.timestamp, next_refresh)
+
+    @staticmethod
+    async def _load_weather_report(city_name: str) -> Optional[CachedResponse]:
+        """Asynchronously build the serialized weather response from the latest observation."""
+        try:
+            weather_data: LatestWeather = await LatestWeather.objects.aget_latest(city=city_name)
+        except LatestWeather.DoesNotExist:
+            return None
+        await aadd_weather_modified(city_name, weather_data.timestamp)
+        next_refreshes = await aget_next_refreshes({city_name: weather_data.timestamp})
+        return WeatherApiView._serialize(weather_data, next_refreshes[city_name])
+
+    @staticmethod
+    async def _load_weather_reports(city_names: list[str]) -> dict[str, CachedResponse]:
+        """Asynchronously build the serialized weather responses of many cities with a single query."""
+        latest = await LatestWeather.objects.aget_latest_many(city_names)
+        await asyncio.gather(*(
+            aadd_weather_modified(city_name, weather_data.timestamp) for city_name, weather_data in latest.items()
+        ))
+        next_refreshes = await aget_next_refreshes(
+            {city_name: weather_data.timestamp for city_name, weather_data in latest.items()}
+        )
+        return {
+            city_name: WeatherApiView._serialize(weather_data, next_refreshes[city_name])
+            for city_name, weather_data in latest.items()
+        }
 
     async def _get_weather_report(self, city: str) -> None:
-        """Asynchronously fetch weather information for the given city."""
+        """Asynchronously fetch the serialized weather response for the given city.
+
+        Responses are cached per language as the final JSON bytes, so a cache hit
+        is served without deserializing or re-encoding anything.
+        """
         city_name = city.lower()
+        self.cache_key = weather_cache_key(city_name)
+        self.weather_report = await aget_or_load(self.cache_key, lambda: self._load_weather_report(city_name))
 
-        # Check if the response is cached; if so, return it from the cache
-        if (response := await cache.aget(city_name)) and response:
-            self.weather_report = response
-            return
+    @staticmethod
+    def _conditional_response(request, cache_key: str, last_modified: datetime) -> tuple[Optional[HttpResponse], str]:
+        """The 304 answer to a revalidation of the observation at ``last_modified``, if any, and its ETag."""
+        etag = quote_etag(
+            hashlib.md5(f'{cache_key}:{last_modified.isoformat()}'.encode(), usedforsecurity=False).hexdigest()
+        )
+        return get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp())), etag
 
-        try:
-            weather_data: WeatherData = await WeatherData.objects.aget_latest(city=city_name)
-        except WeatherData.DoesNotExist:
-            return
-        wr_json = weather_data.to_dict()
+    async def _not_modified_response(self, request, city: str) -> Optional[HttpResponse]:
+        """Answer a revalidation with 304 before the response is loaded, when the client holds the latest observation.
+
+        Only the cached time of the latest observation of the city is read, so
+        neither the response nor the database is touched.
+        """
+        if 'If-None-Match' not in request.headers and 'If-Modified-Since' not in request.headers:
+            return None
+        if (last_modified := await aget_weather_modified(city)) is None:
+            return None
+        response, etag = self._conditional_response(request, weather_cache_key(city), last_modified)
+        if response is None:
+            return None
+        next_refresh = (await aget_next_refreshes({city: last_modified}))[city]
+        return self._with_validators(response, etag, last_modified, next_refresh)
+
+    def _weather_response(self, request) -> HttpResponse:
+        """Answer with the fetched weather report, or with 304 when the client already holds it."""
+        last_modified = self.weather_report.last_modified
+        response, etag = self._conditional_response(request, self.cache_key, last_modified)
+        if response is None:
+            response = HttpResponse(self.weather_report.content, content_type='application/json', status=200)
+        return self._with_validators(response, etag, last_modified, self.weather_report.next_refresh)
 
-        # Cache the response for future use
-        await cache.aset(city.lower(), wr_json)
-        self.weather_report = wr_json
+    @staticmethod
+    def _with_validators(
+        response: HttpResponse, etag: str, last_modified: datetime, next_refresh: datetime
+    ) -> HttpResponse:
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+        # the observation is not replaced before the scheduler refreshes its city
+        patch_cache_control(response, public=True, max_age=max(0, int((next_refresh - timezone.now()).total_seconds())))
+        return response
+
+    async def _get_weather_reports(self, cities: list[str]) -> HttpResponse:
+        """Answer a batch of cities with one cache lookup and at most one query.
+
+        The cached response of every city is embedded as-is, and cities without
+        weather data get an error entry instead of failing the whole batch.
+        """
+        city_names = list(dict.fromkeys(city.lower() for city in cities))
+        if len(city_names) > settings.WEATHER_BATCH_MAX_CITIES:
+            message = _(self.too_many_cities_message) % {'limit': settings.WEATHER_BATCH_MAX_CITIES}
+            return JsonResponse({'status': 'error', 'message': message}, status=400)
+
+        reports = await aget_or_load_many(
+            {city_name: weather_cache_key(city_name) for city_name in city_names}, self._load_weather_reports
+        )
+        found = [city_name for city_name in city_names if reports.get(city_name)]
+        await asyncio.gather(*(arecord_city_hit(city_name) for city_name in found))
+
+        not_found = json.dumps({'status': 'error', 'message': _(self.error_messages[404])}).encode()
+        contents = {city_name: report.content for city_name, report in reports.items() if report}
+        data = b', '.join(
+            json.dumps(city_name).encode() + b': ' + contents.get(city_name, not_found) for city_name in city_names
+        )
+        return HttpResponse(b'{"status": "success", "data": {' + data + b'}}', content_type='application/json')
+
+    async def post(self, request):
+        """Handle POST requests to retrieve weather information for a list of cities."""
+        try:
+            cities = json.loads(request.body).get('cities')
+        except (ValueError, AttributeError):
+            cities = None
+        if not isinstance(cities, list) or not all(isinstance(city, str) and city for city in cities) or not cities:
+            err_response = {'status': 'error', 'message': _(self.error_messages[400])}
+            return JsonResponse(err_response, status=400)
+        return await self._get_weather_reports(cities)
 
     async def get(self, request):
-        """Handle GET requests to retrieve weather information for a given city."""
+        """Handle GET requests to retrieve weather information for one or many cities."""
 
-        if (city := request.GET.get('city')) and city:
+        if len(cities := [city for city in request.GET.getlist('city') if city]) > 1:
+            return await self._get_weather_reports(cities)
+
+        if cities:
+            city = cities[0]
+            if response := await self._not_modified_response(request, city):
+                await arecord_city_hit(city)
+                return response
             await self._get_weather_report(city=city)
+            if self.weather_report:
+                await arecord_city_hit(city)
         else:
             err_response = {'status': 'error', 'message': _(self.error_messages[400])}
             return JsonResponse(err_response, status=400)
@@ -54,5 +204,164 @@ class WeatherApiView(View):
             err_response = {'status': 'error', 'message': _(self.error_messages[404])}
             return JsonResponse(err_response, status=404)
 
-        success_response = {'status': 'success', 'data': self.weather_report}
-        return JsonResponse(success_response, status=200)
+        return self._weather_response(request)
+
+
+class NearbyWeatherApiView(WeatherApiView):
+    """
+    API View to retrieve weather information by coordinates instead of city name.
+    This view supports GET requests with the 'lat' and 'lon' parameters and returns
+    the weather of the nearest city, or with an additional 'radius' in kilometres
+    the weather of every city within it, keyed by city and nearest first. A radius
+    holding more cities than a batch request allows is rejected like that request.
+    """
+
+    http_method_names = ['get']
+    invalid_coordinates_message = _('Bad Request: Invalid coordinates provided.')
+    max_radius = 1000  # in kilometres, so a radius search scans a bounded part of the city index
+
+    async def get(self, request):
+        """Handle GET requests to retrieve weather information around the given coordinates."""
+        try:
+            latitude, longitude = float(request.GET['lat']), float(request.GET['lon'])
+            radius = float(request.GET['radius']) if 'radius' in request.GET else None
+        except (KeyError, ValueError):
+            latitude = longitude = radius = None
+        if (
+            latitude is None or not -90 <= latitude <= 90 or not -180 <= longitude <= 180
+            or (radius is not None and not 0 < radius <= self.max_radius)  # NaN and infinity included
+        ):
+            err_response = {'status': 'error', 'message': _(self.invalid_coordinates_message)}
+            return JsonResponse(err_response, status=400)
+
+        if radius is not None:
+            cities = await city_index.awithin(latitude, longitude, radius)
+            # more cities than a batch allows are rejected like a batch, rather than silently cut off
+            return await self._get_weather_reports([city.name for _distance, city in cities])
+
+        if nearest := await city_index.anearest(latitude, longitude):
+            _distance, city = nearest
+            if response := await self._not_modified_response(request, city.name):
+                await arecord_city_hit(city.name)
+                return response
+            await self._get_weather_report(city=city.name)
+            if self.weather_report:
+                await arecord_city_hit(city.name)
+                return self._weather_response(request)
+
+        err_response = {'status': 'error', 'message': _(self.error_messages[404])}
+        return JsonResponse(err_response, status=404)
+
+
+class CityAutocompleteApiView(View):
+    """
+    API View to suggest city names while they are typed.
+    This view supports GET requests with the 'q' parameter, and an optional 'limit'
+    of at most 50 suggestions. Names starting with 'q' come first, followed by
+    similar names to catch misspellings.
+    """
+
+    max_limit = 50
+
+    async def get(self, request):
+        """Handle GET requests to suggest cities for a partial or misspelled name."""
+        if not (query := request.GET.get('q', '').strip()):
+            err_response = {'status': 'error', 'message': _(WeatherApiView.error_messages[400])}
+            return JsonResponse(err_response, status=400)
+        try:
+            limit = min(max(int(request.GET.get('limit', 10)), 1), self.max_limit)
+        except ValueError:
+            limit = 10
+
+        return JsonResponse({'status': 'success', 'data': await city_names.asuggest(query, limit)})
+
+
+class WeatherHistoryApiView(View):
+    """
+    API View to retrieve the weather history of a city.
+    This view supports GET requests with the 'city' parameter, optional 'from' and
+    'to' ISO 8601 datetimes (the last 30 days by default) and an 'interval' of
+    'raw', 'hour' or 'day'. Pages hold up to 'limit' rows, and the 'next' cursor of
+    a page is passed back as 'after'. With 'format=ndjson' the whole range is
+    streamed instead, one JSON object per line.
+
+    The cursor is the timestamp of the last row at full precision, followed by
+    '~' and the ID of the row for raw rows, as several of them may share a timestamp.
+    """
+
+    intervals = ('raw', 'hour', 'day')
+    default_range = timedelta(days=30)
+    default_limit = 500
+    max_limit = 5000
+    invalid_query_message = _('Bad Request: Invalid history query.')
+
+    @staticmethod
+    def _parse_datetime(value: str) -> datetime:
+        if (parsed := parse_datetime(value)) is None:
+            raise ValueError(value)
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    @classmethod
+    def _parse_cursor(cls, value: str) -> tuple[datetime, Optional[int]]:
+        timestamp, _, row_id = value.partition('~')
+        return cls._parse_datetime(timestamp), int(row_id) if row_id else None
+
+    @staticmethod
+    def _cursor(row: dict) -> str:
+        return row['timestamp'].isoformat() + (f'~{row["id"]}' if 'id' in row else '')
+
+    @staticmethod
+    async def _ndjson(rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+        async for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder).encode() + b'\n'
+
+    async def get(self, request):
+        """Handle GET requests to retrieve the weather history of a city."""
+        if not (city_name := request.GET.get('city', '').strip().lower()):
+            err_response = {'status': 'error', 'message': _(WeatherApiView.error_messages[400])}
+            return JsonResponse(err_response, status=400)
+        try:
+            end = self._parse_datetime(request.GET['to']) if 'to' in request.GET else timezone.now()
+            start = self._parse_datetime(request.GET['from']) if 'from' in request.GET else end - self.default_range
+            after, after_id = self._parse_cursor(request.GET['after']) if 'after' in request.GET else (None, None)
+            limit = int(request.GET.get('limit', self.default_limit))
+            if (interval := request.GET.get('interval', 'hour')) not in self.intervals:
+                raise ValueError(interval)
+            if start >= end or not 1 <= limit <= self.max_limit:
+                raise ValueError(start, end, limit)
+        except ValueError:
+            err_response = {'status': 'error', 'message': _(self.invalid_query_message)}
+            return JsonResponse(err_response, status=400)
+
+        try:
+            city = await City.objects.only('name').aget(name=city_name)
+        except City.DoesNotExist:
+            err_response = {'status': 'error', 'message': _(WeatherApiView.error_messages[404])}
+            return JsonResponse(err_response, status=404)
+
+        if request.GET.get('format') == 'ndjson':
+            rows = WeatherData.objects.ahistory(city, interval, start, end, after=after, after_id=after_id)
+            return StreamingHttpResponse(self._ndjson(rows), content_type='application/x-ndjson')
+
+        rows = [row async for row in WeatherData.objects.ahistory(city, interval, start, end, after, limit, after_id)]
+        next_cursor = self._cursor(rows[-1]) if len(rows) == limit else None
+        return JsonResponse({'status': 'success', 'data': rows, 'next': next_cursor})
+
+
+class MetricsView(View):
+    """
+    Metrics of the API and the weather loader in the Prometheus text format,
+    collected from every process that published them. Scrapes must send
+    ``METRICS_TOKEN`` as a bearer token when it is set.
+    """
+
+    http_method_names = ['get']
+
+    async def get(self, request):
+        if settings.METRICS_TOKEN and not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode(), f'Bearer {settings.METRICS_TOKEN}'.encode()
+        ):
+            response = HttpResponse(status=401)
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+        return HttpResponse(await metrics.acollect(), content_type=CONTENT_TYPE_LATEST)